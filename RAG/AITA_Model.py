@@ -2,7 +2,16 @@
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
+import asyncio
 import time
+import sys
+import os
+
+# History is kept like the backend's chat sessions: recent turns within a token
+# budget, older turns folded into a rolling summary (backend/session_memory.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from session_memory import SessionStore, history_contents, summary_prompt, summarize_overflow
+from gemini_scheduler import PRIORITY_BULK, PRIORITY_STUDENT, estimate_request_tokens, scheduler
 
 # Load environment variables
 load_dotenv()
@@ -79,8 +88,35 @@ else:
     exit()
 
 
-# Initialize conversation history
-conversation_history = []
+# Same env var as the backend's lite tier (gemini-2.5-flash-lite -> 1500 requests/day;
+# gemini-2.0-flash-exp -> 50 requests/day)
+MODEL = os.getenv("MODEL_TIER_LITE", "gemini-2.5-flash-lite")
+
+# Gemini calls go through the backend's scheduler (backend/gemini_scheduler.py): same
+# RPM/TPM budgets and 429 backoff. Its queues belong to one event loop, so the whole
+# session runs on this one instead of a new loop per asyncio.run().
+loop = asyncio.new_event_loop()
+
+async def generate(model, contents, config, priority=PRIORITY_STUDENT):
+    return await scheduler.run(
+        model,
+        lambda: client.aio.models.generate_content(model=model, contents=contents, config=config),
+        tokens=estimate_request_tokens(contents, config.system_instruction),
+        priority=priority
+    )
+
+async def summarize(previous_summary, turns):
+    response = await generate(
+        MODEL,
+        summary_prompt(previous_summary, turns),
+        types.GenerateContentConfig(temperature=0.2),
+        priority=PRIORITY_BULK
+    )
+    return response.text
+
+# Initialize conversation history (in memory, gone when the program exits)
+conversation_history = SessionStore(path=":memory:")
+SESSION_ID = "cli"
 print("---------------------------------------------------------------------------------")
 print("Type 'quit' to end conversation.\n")
 print("AITA: Hello, my name is AITA, your friendly AI academic assistant. How can I help you?")
@@ -88,34 +124,38 @@ print("AITA: Hello, my name is AITA, your friendly AI academic assistant. How ca
 user_input = input("You: ")
 
 while user_input.lower() != "quit":
-    # Add user message to history
-    conversation_history.append(
+    # Send the session history along with the new message
+    window = conversation_history.load_window(SESSION_ID)
+    contents = history_contents(window) + [
         types.Content(role="user", parts=[types.Part(text=user_input)])
-    )
+    ]
 
     try:
         # Generate response from Gemini
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite",  #gemini-2.5-flash-lite -> 1500 Requests per day; gemini-2.0-flash-exp -> 50 requests per day
-            contents=conversation_history,
-            config=types.GenerateContentConfig(
+        response = loop.run_until_complete(generate(
+            MODEL,
+            contents,
+            types.GenerateContentConfig(
                 system_instruction=system_prompt,
                 temperature=0.7,
             )
-        )
+        ))
 
         # Extract response text
         response_text = response.text
         print("AITA: ", response_text)
 
+        # Keep the exchange for follow-up questions
+        conversation_history.append_turn(SESSION_ID, user_input, response_text)
+
     except Exception as e:
-        if str(e) == "429 RESOURCE_EXHAUSTED. {'error': {'code': 429, 'message': 'Resource exhausted. Please try again later. Please refer to https://cloud.google.com/vertex-ai/generative-ai/docs/error-code-429 for more details.', 'status': 'RESOURCE_EXHAUSTED'}}":
-            time.sleep(2)
-            continue
         print(f"AITA: I encountered an error: {str(e)}")
-        # Remove the user message if there was an error
-        if conversation_history and conversation_history[-1].role == "user":
-            conversation_history.pop()
+    else:
+        try:
+            # Fold turns that no longer fit the token budget into the summary
+            loop.run_until_complete(summarize_overflow(conversation_history, SESSION_ID, window, summarize))
+        except Exception as e:
+            print(f"(Could not summarize the earlier conversation: {str(e)})")
 
     user_input = input("You: ")
 
@@ -0,0 +1,191 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from course_versions import get_version
+from embedding_cache import get_embedding_function
+
+# Cached answers are reused for questions at least this similar (cosine)
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+# Answers kept per (course, subject, guardrail level); oldest are dropped first
+ANSWER_CACHE_MAX_PER_SCOPE = int(os.getenv("ANSWER_CACHE_MAX_PER_SCOPE", "500"))
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+
+def normalize_question(question):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!. ")
+
+class _Scope:
+    """Cached answers for one (course, subject, guardrail level)"""
+
+    def __init__(self):
+        self.entries = []  # dicts: question, answer, sources, vector, created_at, version
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.by_question = {}  # normalized question -> entry
+
+    def rebuild(self):
+        self.by_question = {entry["question"]: entry for entry in self.entries}
+        if self.entries:
+            self.vectors = np.stack([entry["vector"] for entry in self.entries])
+        else:
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+
+class AnswerCache:
+    """
+    Semantic cache of chat answers
+
+    Answers are grouped by (course_id, subject, guardrail_level) so a cached
+    answer is only reused under the same prompt and course materials. A
+    question matches exactly (after normalization) or by embedding
+    similarity above the threshold. Entries expire after the TTL and are
+    dropped as soon as the course's materials change (see course_versions).
+    """
+    def __init__(self, threshold=None, ttl=None, max_per_scope=None, embedding_function=None):
+        self.threshold = threshold or ANSWER_CACHE_THRESHOLD
+        self.ttl = ttl or ANSWER_CACHE_TTL
+        self.max_per_scope = max_per_scope or ANSWER_CACHE_MAX_PER_SCOPE
+        self._embed = embedding_function
+        self._scopes = {}
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    @staticmethod
+    def _scope_key(course_id, subject, guardrail_level):
+        return (str(course_id) if course_id else None, subject.lower(), guardrail_level.lower())
+
+    def _embedding(self, question):
+        if self._embed is None:
+            self._embed = get_embedding_function()
+        vector = np.asarray(self._embed([question])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _live_scope(self, key, version, now):
+        """Scope for key with expired and outdated entries removed (lock held)"""
+        scope = self._scopes.get(key)
+        if scope is None:
+            return None
+        live = [
+            entry for entry in scope.entries
+            if entry["version"] == version and now - entry["created_at"] < self.ttl
+        ]
+        if len(live) != len(scope.entries):
+            self.counts["expired"] += len(scope.entries) - len(live)
+            scope.entries = live
+            scope.rebuild()
+        return scope
+
+    def lookup(self, question, course_id=None, subject="generic", guardrail_level="moderate"):
+        """
+        Find a cached answer for a question
+
+        Returns:
+            (entry, vector, version): entry is a dict with "answer", "sources"
+            and "similarity" (None on a miss). vector (the question embedding)
+            and version (the course version looked up against) can be passed
+            to store() for the answer generated on a miss.
+        """
+        course_id = course_id or None  # "" is unfiltered too
+        key = self._scope_key(course_id, subject, guardrail_level)
+        normalized = normalize_question(question)
+        version = get_version(course_id)
+        now = time.time()
+
+        with self._lock:
+            scope = self._live_scope(key, version, now)
+            if scope is not None and normalized in scope.by_question:
+                entry = scope.by_question[normalized]
+                self.counts["exact_hits"] += 1
+                return {"answer": entry["answer"], "sources": entry["sources"], "similarity": 1.0}, None, version
+            has_entries = scope is not None and len(scope.entries) > 0
+
+        vector = self._embedding(normalized)
+        if not has_entries:
+            with self._lock:
+                self.counts["misses"] += 1
+            return None, vector, version
+
+        with self._lock:
+            scope = self._live_scope(key, version, now)
+            if scope is not None and scope.entries:
+                similarities = scope.vectors @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry = scope.entries[best]
+                    self.counts["semantic_hits"] += 1
+                    return {
+                        "answer": entry["answer"],
+                        "sources": entry["sources"],
+                        "similarity": round(float(similarities[best]), 4)
+                    }, vector, version
+            self.counts["misses"] += 1
+        return None, vector, version
+
+    def store(self, question, answer, sources, course_id=None, subject="generic",
+              guardrail_level="moderate", vector=None, version=None):
+        """
+        Cache an answer
+
+        version should be the course version read before retrieval, so an
+        answer built from materials that changed mid-request is never served.
+        """
+        if not answer:
+            return
+        course_id = course_id or None
+        key = self._scope_key(course_id, subject, guardrail_level)
+        normalized = normalize_question(question)
+        if vector is None:
+            vector = self._embedding(normalized)
+        if version is None:
+            version = get_version(course_id)
+
+        with self._lock:
+            scope = self._scopes.setdefault(key, _Scope())
+            scope.entries = [entry for entry in scope.entries if entry["question"] != normalized]
+            scope.entries.append({
+                "question": normalized,
+                "answer": answer,
+                "sources": sources,
+                "vector": vector,
+                "created_at": time.time(),
+                "version": version
+            })
+            if len(scope.entries) > self.max_per_scope:
+                self.counts["evicted"] += len(scope.entries) - self.max_per_scope
+                scope.entries = scope.entries[-self.max_per_scope:]
+            scope.rebuild()
+            self.counts["stores"] += 1
+
+    async def alookup(self, *args, **kwargs):
+        # Embedding is CPU-bound; keep it off the event loop
+        return await asyncio.to_thread(self.lookup, *args, **kwargs)
+
+    async def astore(self, *args, **kwargs):
+        return await asyncio.to_thread(self.store, *args, **kwargs)
+
+    def stats(self):
+        """Hit/miss counters for this process"""
+        with self._lock:
+            hits = self.counts["exact_hits"] + self.counts["semantic_hits"]
+            lookups = hits + self.counts["misses"]
+            return {
+                "enabled": ANSWER_CACHE_ENABLED,
+                "hits": hits,
+                "exact_hits": self.counts["exact_hits"],
+                "semantic_hits": self.counts["semantic_hits"],
+                "misses": self.counts["misses"],
+                "hit_rate": round(hits / lookups, 4) if lookups else None,
+                "stores": self.counts["stores"],
+                "expired": self.counts["expired"],
+                "evicted": self.counts["evicted"],
+                "entries": sum(len(scope.entries) for scope in self._scopes.values()),
+                "scopes": len(self._scopes),
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl
+            }
@@ -0,0 +1,305 @@
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from course_versions import get_legacy_version, get_version
+
+# Where per-course keyword indexes are saved between restarts
+BM25_INDEX_DIR = os.getenv("BM25_INDEX_DIR", "bm25_index")
+# Standard BM25 parameters
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Chunks read from Chroma per call while building an index
+_BUILD_PAGE_SIZE = 1000
+
+# Identifiers (snake_case, dotted names like np.linalg.norm) stay whole
+_TOKEN_RE = re.compile(r"[a-z0-9_]+(?:\.[a-z0-9_]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i if in is it its of on or "
+    "that the this to was what when where which who why will with you your".split()
+)
+
+def tokenize(text):
+    """Lowercased word/identifier tokens without stopwords"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if "." in token:
+            # Also match the parts of a dotted name on their own
+            tokens.extend(part for part in token.split(".") if part and part not in _STOPWORDS)
+    return tokens
+
+class BM25Index:
+    """
+    Immutable inverted index over one set of chunks
+
+    Postings are stored CSR-style in flat numpy arrays: the terms are a
+    sorted byte-string array, and term i's postings are
+    doc_ids[offsets[i]:offsets[i+1]] with matching term frequencies. Chunk
+    texts are not kept; callers fetch them from Chroma by id.
+    """
+    def __init__(self, ids, doc_lengths, terms, offsets, doc_ids, term_freqs, version=0):
+        self.ids = ids
+        self.doc_lengths = doc_lengths
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.version = version
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    @classmethod
+    def build(cls, chunks, version=0):
+        """
+        Index (chunk id, text) pairs
+
+        Args:
+            chunks: Iterable of (id, text)
+            version: Course version the chunks were read at
+
+        Returns:
+            BM25Index
+        """
+        ids, lengths = [], []
+        postings = {}  # term -> ([doc], [tf])
+        for doc, (chunk_id, text) in enumerate(chunks):
+            ids.append(chunk_id)
+            counts = {}
+            tokens = tokenize(text or "")
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            lengths.append(len(tokens))
+            for term, tf in counts.items():
+                docs, tfs = postings.setdefault(term, ([], []))
+                docs.append(doc)
+                tfs.append(tf)
+
+        terms = sorted(postings)
+        sizes = np.fromiter((len(postings[term][0]) for term in terms), dtype=np.int64, count=len(terms))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        term_freqs = np.empty(offsets[-1], dtype=np.uint16)
+        for i, term in enumerate(terms):
+            docs, tfs = postings[term]
+            doc_ids[offsets[i]:offsets[i + 1]] = docs
+            term_freqs[offsets[i]:offsets[i + 1]] = np.minimum(tfs, np.iinfo(np.uint16).max)
+
+        return cls(
+            np.array([chunk_id.encode("utf-8") for chunk_id in ids], dtype="S"),
+            np.array(lengths, dtype=np.int32),
+            np.array([term.encode("ascii") for term in terms], dtype="S"),
+            offsets, doc_ids, term_freqs, version
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, n_results=10):
+        """
+        Top chunks for a query by BM25 score
+
+        Returns:
+            List of (chunk id, score), best first; chunks sharing no term with the query are left out
+        """
+        if not len(self.ids):
+            return []
+        query_terms = np.array(sorted({term.encode("ascii") for term in tokenize(query)}), dtype="S")
+        if not len(query_terms):
+            return []
+
+        positions = np.searchsorted(self.terms, query_terms)
+        positions = positions[positions < len(self.terms)]
+        positions = positions[np.isin(self.terms[positions], query_terms)]
+
+        n_docs = len(self.ids)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for position in positions:
+            start, end = self.offsets[position], self.offsets[position + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end].astype(np.float32)
+            idf = np.log(1.0 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_lengths[docs] / max(self.avg_length, 1.0))
+            scores[docs] += idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > n_results:
+            matched = matched[np.argpartition(-scores[matched], n_results - 1)[:n_results]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self.ids[doc].decode("utf-8"), float(scores[doc])) for doc in matched]
+
+    def save(self, path):
+        """Write the arrays to an .npz file (atomically replacing any old one)"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f, ids=self.ids, doc_lengths=self.doc_lengths, terms=self.terms,
+                offsets=self.offsets, doc_ids=self.doc_ids, term_freqs=self.term_freqs,
+                version=np.int64(self.version)
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["ids"], data["doc_lengths"], data["terms"], data["offsets"],
+                data["doc_ids"], data["term_freqs"], int(data["version"])
+            )
+
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.ids, self.doc_lengths, self.terms, self.offsets, self.doc_ids, self.term_freqs))
+
+class BM25Indexes:
+    """
+    One BM25Index per course collection (plus one for chunks not tied to a course)
+
+    Indexes are tagged with the course version they were built at (see
+    course_versions); the legacy index has its own version, which course
+    ingests don't touch. Ingestion and deletes rebuild the affected course's
+    index right away; any other process notices the bumped version on its
+    next search and reloads from disk or rebuilds from Chroma.
+
+    A search never waits for a rebuild when an older index exists: while a
+    course is being ingested its version moves on every batch, so searches
+    keep using the previous index and a background thread rebuilds it.
+    Only a course with no index at all is built in the request thread.
+    """
+    def __init__(self, index_dir=None):
+        self.index_dir = Path(index_dir or BM25_INDEX_DIR)
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._build_locks = {}  # one build per index at a time (they share a file)
+        self._rebuilding = set()
+        self.builds = 0
+        self.stale_served = 0
+
+    @staticmethod
+    def _version(course_id):
+        return get_version(course_id) if course_id else get_legacy_version()
+
+    def _path(self, course_id):
+        name = f"course_{course_id}" if course_id else "legacy"
+        return self.index_dir / f"{name}.npz"
+
+    def rebuild(self, collection, course_id=None):
+        """
+        Build a course's index from the chunks in Chroma and save it
+
+        Args:
+            collection: The course's Chroma collection (see course_collections)
+            course_id: Course to index (None: chunks not tied to a course)
+
+        Returns:
+            The new BM25Index
+        """
+        key = str(course_id) if course_id else None
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            return self._rebuild(collection, course_id, key)
+
+    def _rebuild(self, collection, course_id, key):
+        started = time.perf_counter()
+        # Read the version first: a write that lands mid-build leaves the index stale
+        version = self._version(course_id)
+
+        def chunks():
+            offset = 0
+            while True:
+                page = collection.get(include=["documents"], limit=_BUILD_PAGE_SIZE, offset=offset)
+                yield from zip(page["ids"], page["documents"])
+                if len(page["ids"]) < _BUILD_PAGE_SIZE:
+                    return
+                offset += _BUILD_PAGE_SIZE
+
+        index = BM25Index.build(chunks(), version)
+        index.save(self._path(course_id))
+        with self._lock:
+            self._indexes[key] = index
+            self.builds += 1
+        print(
+            f"🔤 Built keyword index for {f'course {course_id}' if course_id else 'legacy chunks'}: "
+            f"{len(index)} chunks, {len(index.terms)} terms in {1000 * (time.perf_counter() - started):.0f}ms"
+        )  # DEBUG
+        return index
+
+    def get(self, collection, course_id=None):
+        """
+        Index for a course, loading or building it if needed
+
+        Returns:
+            (index, current): current is False when an older index is
+            served while a newer one is built in the background
+        """
+        key = str(course_id) if course_id else None
+        version = self._version(course_id)
+        with self._lock:
+            index = self._indexes.get(key)
+        if index is not None and index.version == version:
+            return index, True
+
+        path = self._path(course_id)
+        if path.exists():
+            try:
+                loaded = BM25Index.load(path)
+            except Exception as e:
+                print(f"⚠️ Could not load keyword index {path}: {e}")
+                loaded = None
+            if loaded is not None and (index is None or loaded.version > index.version):
+                index = loaded
+                with self._lock:
+                    self._indexes[key] = index
+            if index is not None and index.version == version:
+                return index, True
+        if index is None:
+            return self.rebuild(collection, course_id), True
+
+        self._rebuild_in_background(collection, course_id, key)
+        with self._lock:
+            self.stale_served += 1
+        return index, False
+
+    def _rebuild_in_background(self, collection, course_id, key):
+        with self._lock:
+            if key in self._rebuilding:
+                return
+            self._rebuilding.add(key)
+
+        def run():
+            try:
+                self.rebuild(collection, course_id)
+            except Exception as e:
+                print(f"⚠️ Keyword index rebuild failed for {f'course {course_id}' if course_id else 'legacy chunks'}: {type(e).__name__}: {e}")
+            finally:
+                with self._lock:
+                    self._rebuilding.discard(key)
+
+        threading.Thread(target=run, name=f"bm25-rebuild-{key}", daemon=True).start()
+
+    def search(self, collection, query, n_results=10, course_id=None):
+        """BM25 (chunk id, score) pairs for a query within a course"""
+        return self.get(collection, course_id)[0].search(query, n_results)
+
+    def stats(self):
+        with self._lock:
+            indexes = dict(self._indexes)
+        return {
+            "loaded": len(indexes),
+            "builds": self.builds,
+            "stale_served": self.stale_served,
+            "chunks": sum(len(index) for index in indexes.values()),
+            "terms": sum(len(index.terms) for index in indexes.values()),
+            "memory_bytes": sum(index.nbytes() for index in indexes.values())
+        }
+
+bm25_indexes = BM25Indexes()
@@ -1,14 +1,32 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, Depends, FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 from typing import Optional
-import requests
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import partial
 import time
+import asyncio
+import json
 import os
 
+from auth import decode_token
+from answer_cache import ANSWER_CACHE_ENABLED, AnswerCache, normalize_question
+from coalescer import Coalescer
+from context_cache import ContextCache, prefix_tokens
+from context_packer import pack_context, token_budget_for
+from course_versions import get_version
+from database import SessionLocal, Course, CourseFile
+from gemini_scheduler import PRIORITY_BULK, PRIORITY_STUDENT, PRIORITY_TEACHER, estimate_request_tokens, is_rate_limited, scheduler
+from model_router import MODEL_TIERS, ModelRouter
+from retrieval import create_retrieval_client
+from session_memory import SessionStore, history_contents, load_window_summarized, summary_prompt, summarize_overflow
+
 # Load environment variables
 load_dotenv()
 
@@ -23,8 +41,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Gemini client
-client = genai.Client()
+# Search results retrieved per question: enough chunks of CONTEXT_CHUNK_TOKENS to fill the
+# context token budget (see context_packer), at most CONTEXT_MAX_RESULTS
+CONTEXT_CHUNK_TOKENS = int(os.getenv("CONTEXT_CHUNK_TOKENS", "150"))
+CONTEXT_MAX_RESULTS = int(os.getenv("CONTEXT_MAX_RESULTS", "20"))
+
+# Tokens from the start of a course's materials cached by Gemini together with the
+# system prompt (see context_cache); 0 leaves them out
+CONTEXT_CACHE_COURSE_TOKENS = int(os.getenv("CONTEXT_CACHE_COURSE_TOKENS", "8000"))
+# Courses whose material is kept in memory between questions
+COURSE_MATERIAL_MEMO_SIZE = 64
+
+# Seconds clients are asked to wait after a Gemini rate limit
+RATE_LIMIT_RETRY_AFTER = int(os.getenv("RATE_LIMIT_RETRY_AFTER", "2"))
+
+# Chat routes; served by this app and also included by the backend (main.py)
+router = APIRouter()
+
+# Gemini client, created on first use so importing this module needs no API key
+_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = genai.Client()
+    return _client
+
+# How course materials are retrieved (see retrieval.py); the backend swaps in
+# an in-process client when it serves these routes itself
+retrieval_client = create_retrieval_client()
+
+def set_retrieval_client(retrieval):
+    global retrieval_client
+    retrieval_client = retrieval
 
 # Subject-specific system prompts (from AITA_Model.py)
 SYSTEM_PROMPTS = {
@@ -60,58 +109,79 @@ SYSTEM_PROMPTS = {
         """
 }
 
+# How strictly the tutor withholds final answers, per the course's guardrail_level
+# set by the teacher (appended to the subject prompt)
+DEFAULT_GUARDRAIL_LEVEL = "moderate"
+GUARDRAIL_PROMPTS = {
+    "relaxed": """You may confirm whether an answer the student worked out themselves is correct, and you may
+        walk through a complete worked example of a similar (but not the same) problem.
+        """,
+    "moderate": "",
+    "strict": """Never confirm, reveal or hint at final answers, even if the student asks directly or says they
+        have already finished. Respond only with guiding questions and pointers to the relevant course materials.
+        """
+}
+
 # Request model
 class ChatRequest(BaseModel):
     question: str
     subject: str = "generic"
     course_id: Optional[str] = None  # Filter by specific course
+    session_id: Optional[str] = None  # Continue a multi-turn conversation (signed-in users only)
 
 # Response model
 class ChatResponse(BaseModel):
     answer: str
     sources: list = []
+    cached: bool = False
+
+# Model used to summarize older turns of long chat sessions
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", MODEL_TIERS["lite"])
+
+# Picks the Gemini model per question and falls back across tiers (see model_router.py)
+model_router = ModelRouter(scheduler=scheduler)
+
+# With another tier to fall back to, give up on a rate-limited model sooner
+FALLBACK_MAX_RETRIES = int(os.getenv("FALLBACK_MAX_RETRIES", "1"))
+
+# Server-side conversation history (see session_memory.py)
+session_store = SessionStore()
+
+# Provider-side cache of the system prompt (per subject and guardrail level)
+context_cache = ContextCache(client=get_client)
+
+# Shares one generation between identical questions asked at the same time
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+coalescer = Coalescer()
+
+# Reuses answers to repeated questions (per course, subject and guardrail level)
+answer_cache = AnswerCache()
 
-def query_chroma(question: str, course_id: str = None, n_results: int = 3):
+async def query_chroma(question: str, course_id: str = None, n_results: int = 3, keep_adjacent: bool = False):
     """
-    Query the backend's Chroma database for relevant course materials
+    Retrieve relevant course materials through the configured retrieval client
     
     Args:
         question: The student's question
         course_id: Optional course ID to filter results
         n_results: Number of results to return
+        keep_adjacent: Keep neighbouring chunks so the packer can merge them
     """
-    try:
-        url = "http://localhost:8000/api/query-chroma"
-        params = {"query": question, "n_results": n_results}
-        
-        # Add course_id filter if provided
-        if course_id:
-            params["course_id"] = course_id
-        
-        print(f"🔍 Querying: {url} with params: {params}")  # DEBUG
-        
-        response = requests.get(url, params=params, timeout=10)
-        print(f"📡 Response status: {response.status_code}")  # DEBUG
-        
-        response.raise_for_status()
-        data = response.json()
-        print(f"📦 Data received: {data.get('num_results', 0)} results")  # DEBUG
-        
-        return data
-    except requests.exceptions.ConnectionError as e:
-        print(f"❌ CONNECTION ERROR: Cannot reach backend at port 8000")
-        print(f"   Make sure backend is running: uvicorn main:app --reload")
-        return None
-    except requests.exceptions.Timeout:
-        print(f"⏱️ TIMEOUT: Backend didn't respond in time")
-        return None
-    except Exception as e:
-        print(f"❌ Error querying Chroma: {type(e).__name__}: {e}")
-        return None
+    print(f"🔍 Retrieving ({type(retrieval_client).__name__}) course_id={course_id} n_results={n_results}")  # DEBUG
+    return await retrieval_client.retrieve(
+        question, course_id=course_id, n_results=n_results, keep_adjacent=keep_adjacent
+    )
 
-def format_context_from_chroma(chroma_results):
+def context_results_for(token_budget):
+    """Search results to retrieve to fill a context token budget"""
+    return max(1, min(CONTEXT_MAX_RESULTS, -(-token_budget // CONTEXT_CHUNK_TOKENS)))
+
+def format_context_from_chroma(chroma_results, token_budget=None):
     """
     Format Chroma results into context string for Gemini
+
+    Adjacent chunks are merged and the context is limited to token_budget
+    tokens (see context_packer).
     """
     if not chroma_results or not chroma_results.get("results"):
         print("⚠️ No results from Chroma query")  # DEBUG
@@ -119,14 +189,15 @@ def format_context_from_chroma(chroma_results):
     
     print(f"✅ Formatting {len(chroma_results['results'])} results")  # DEBUG
     
+    passages, tokens = pack_context(chroma_results["results"], token_budget)
     context_parts = []
     sources = []
     
-    for i, result in enumerate(chroma_results["results"]):
-        content = result.get("content", "")
-        metadata = result.get("metadata", {})
+    for i, passage in enumerate(passages):
+        content = passage["content"]
+        metadata = passage["metadata"]
         
-        print(f"   Result {i+1}: {len(content)} chars, metadata: {metadata}")  # DEBUG
+        print(f"   Source {i+1}: {len(content)} chars from chunks {passage['chunk_ids']}, metadata: {metadata}")  # DEBUG
         
         context_parts.append(f"[Source {i+1}]: {content}")
         
@@ -139,77 +210,564 @@ def format_context_from_chroma(chroma_results):
         )
 
         sources.append({
-            "rank": result.get("rank", i+1),
+            "rank": i + 1,
             "course": course_name,
             "chunk_id": metadata.get("chunk_id", "Unknown"),
+            "chunk_ids": passage["chunk_ids"],
             "file_id": metadata.get("file_id", "Unknown")
         })
     
     context = "\n\n".join(context_parts)
-    print(f"📝 Created context: {len(context)} characters")  # DEBUG
+    print(f"📝 Created context: {len(context)} characters, ~{tokens} tokens")  # DEBUG
     print(f"📚 Created {len(sources)} source citations")  # DEBUG
     
     return context, sources
 
-@app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    """
-    Main chat endpoint that combines Chroma retrieval with Gemini generation
-    """
-    try:
-        # Step 1: Query Chroma for relevant course materials
-        print(f"Querying Chroma for: {request.question}")  # DEBUG
-        if request.course_id:
-            print(f"📚 Filtering by course_id: {request.course_id}")  # DEBUG
-        chroma_results = query_chroma(request.question, course_id=request.course_id, n_results=3)
-        context, sources = format_context_from_chroma(chroma_results)
-        # Step 2: Build the prompt with context
-        system_prompt = SYSTEM_PROMPTS.get(request.subject.lower(), SYSTEM_PROMPTS["generic"])
-        
-        if context:
-            # Add context to the user's question
-            enhanced_question = f"""Here are relevant materials from the course:
+def build_enhanced_question(question: str, context: Optional[str]):
+    """Wrap the student's question with retrieved course materials (if any)"""
+    if context:
+        # Add context to the user's question
+        return f"""Here are relevant materials from the course:
 
 {context}
 
-Student question: {request.question}
+Student question: {question}
 
 Please answer the student's question using the course materials provided above. Cite the sources when you use them (e.g., "According to Source 1..."). If the course materials don't contain the answer, you can say so and provide general guidance."""
-        else:
-            # No context found - answer generally
-            enhanced_question = f"""{request.question}
+    # No context found - answer generally
+    return f"""{question}
 
 Note: I couldn't find specific course materials related to this question, so I'll provide general guidance."""
-        
-        # Step 3: Call Gemini with the enhanced prompt
-        conversation_history = [
-            types.Content(role="user", parts=[types.Part(text=enhanced_question)])
-        ]
-        
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-exp",
-            contents=conversation_history,
-            config=types.GenerateContentConfig(
-                system_instruction=system_prompt,
-                temperature=0.7,
+
+def get_guardrail_level(course_id):
+    """
+    Guardrail level the teacher set for a course
+
+    Read from the Course row, never from the request, so students can't
+    loosen it. Questions without a (known) course get DEFAULT_GUARDRAIL_LEVEL.
+    """
+    if not course_id or not str(course_id).isdigit():
+        return DEFAULT_GUARDRAIL_LEVEL
+    db = SessionLocal()
+    try:
+        course = db.query(Course.guardrail_level).filter(Course.id == int(course_id)).first()
+    finally:
+        db.close()
+    level = (course.guardrail_level or "").lower() if course else ""
+    return level if level in GUARDRAIL_PROMPTS else DEFAULT_GUARDRAIL_LEVEL
+
+async def lookup_cached_answer(request: ChatRequest, guardrail: str, window=None):
+    """
+    Check the answer cache for this question
+
+    Skipped when the session already has history, since the answer then
+    depends on the earlier conversation.
+
+    Returns:
+        (cached, ticket): cached is a dict with "answer" and "sources" or None;
+        pass ticket to remember_answer once the answer has been generated
+    """
+    if not ANSWER_CACHE_ENABLED or (window is not None and not window.empty):
+        return None, None
+    try:
+        cached, vector, version = await answer_cache.alookup(
+            request.question, request.course_id, request.subject, guardrail
+        )
+    except Exception as e:
+        # The cache is an optimization; never fail a chat because of it
+        print(f"⚠️ Answer cache lookup failed: {type(e).__name__}: {e}")
+        return None, None
+    if cached:
+        print(f"💾 Answer cache hit (similarity {cached['similarity']})")  # DEBUG
+    return cached, (vector, version)
+
+async def remember_answer(request: ChatRequest, guardrail: str, answer: str, sources: list, ticket):
+    """Store a freshly generated answer in the answer cache"""
+    if ticket is None:
+        return
+    vector, version = ticket
+    try:
+        await answer_cache.astore(
+            request.question, answer, sources, request.course_id, request.subject,
+            guardrail, vector=vector, version=version
+        )
+    except Exception as e:
+        print(f"⚠️ Answer cache store failed: {type(e).__name__}: {e}")
+
+# Chat works without signing in; a token is only needed for sessions
+optional_bearer = HTTPBearer(auto_error=False)
+
+def get_chat_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_bearer)):
+    """
+    Claims of the caller's access token ({"user_id", "role"}), or None
+
+    Chat works without signing in, so a missing, expired or invalid token
+    just makes the caller anonymous; get_session_key rejects anonymous
+    callers that ask for session memory.
+    """
+    if credentials is None:
+        return None
+    try:
+        return decode_token(credentials.credentials)
+    except HTTPException:
+        return None
+
+def get_priority(user):
+    """Scheduler priority of a caller: teachers ahead of students (summaries run at PRIORITY_BULK)"""
+    if user and user.get("role") == "teacher":
+        return PRIORITY_TEACHER
+    return PRIORITY_STUDENT
+
+def get_session_key(session_id: Optional[str], user):
+    """
+    Key of a user's chat session in the session store
+
+    Sessions belong to the signed-in user who started them; the same
+    session_id sent by someone else refers to a different (empty) session.
+
+    Returns:
+        The key, or None when no session_id was sent
+
+    Raises:
+        HTTPException: 401 if a session_id was sent without a valid token
+    """
+    if not session_id:
+        return None
+    if not user or user.get("user_id") is None:
+        raise HTTPException(status_code=401, detail="Sign in to keep a chat session")
+    return f"{user['user_id']}:{session_id}"
+
+async def load_session(session_key, priority=PRIORITY_STUDENT):
+    """Session history for a session key, or None when there is no session"""
+    if not session_key:
+        return None
+    # A summary made here holds up the caller's answer, so it runs at their priority
+    return await load_window_summarized(
+        session_store, session_key, partial(summarize_turns, priority=priority)
+    )
+
+async def summarize_turns(previous_summary: str, turns: list, priority=PRIORITY_BULK):
+    """Ask Gemini for an updated rolling summary of a tutoring session"""
+    prompt = summary_prompt(previous_summary, turns)
+    response = await scheduler.run(
+        SUMMARY_MODEL,
+        lambda: get_client().aio.models.generate_content(
+            model=SUMMARY_MODEL,
+            contents=prompt,
+            config=types.GenerateContentConfig(temperature=0.2)
+        ),
+        tokens=estimate_request_tokens(prompt),
+        priority=priority
+    )
+    return response.text
+
+# Summaries run after the response is sent; keep references so tasks aren't collected
+_background_tasks = set()
+
+async def record_turn(request: ChatRequest, session_key, window, answer: str):
+    """Save the exchange to the session and summarize turns that fell out of the window"""
+    if window is None or not answer:
+        return
+    await asyncio.to_thread(
+        session_store.append_turn, session_key, request.question, answer, request.course_id
+    )
+
+    async def summarize():
+        try:
+            await summarize_overflow(session_store, session_key, window, summarize_turns)
+        except Exception as e:
+            # Unsummarized turns just stay out of the prompt until the next attempt
+            print(f"⚠️ Session summary failed: {type(e).__name__}: {e}")
+
+    task = asyncio.create_task(summarize())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@dataclass
+class Generation:
+    """A prepared Gemini request for one chat message"""
+    contents: list
+    config: types.GenerateContentConfig  # uncached: carries the system instruction
+    sources: list
+    models: list  # routed models, preferred first
+    # Context cache name for models[0]: system prompt plus course material (uncached calls go without the material)
+    cached_content: Optional[str] = None
+    cached_tokens: int = 0
+    priority: int = PRIORITY_STUDENT  # scheduler priority of the caller (see get_priority)
+
+async def prepare_generation(request: ChatRequest, guardrail: str, window=None):
+    """
+    Retrieve course materials and build the Gemini request for a chat message
+
+    Args:
+        request: Chat request
+        guardrail: The course's guardrail level (see get_guardrail_level)
+        window: SessionWindow whose summary and recent turns precede the question
+
+    Returns:
+        Generation ready for generate()
+    """
+    # Step 1: Query Chroma for relevant course materials
+    print(f"Querying Chroma for: {request.question}")  # DEBUG
+    if request.course_id:
+        print(f"📚 Filtering by course_id: {request.course_id}")  # DEBUG
+    models = model_router.route(request.question, request.subject)
+    # The same context goes to every fallback model, so it must fit the smallest budget
+    token_budget = min(token_budget_for(model) for model in models)
+    chroma_results = await query_chroma(
+        request.question, course_id=request.course_id,
+        n_results=context_results_for(token_budget), keep_adjacent=True
+    )
+    context, sources = format_context_from_chroma(chroma_results, token_budget)
+
+    # Step 2: Build the prompt with context
+    system_prompt = SYSTEM_PROMPTS.get(request.subject.lower(), SYSTEM_PROMPTS["generic"])
+    system_prompt += GUARDRAIL_PROMPTS[guardrail]
+    contents = history_contents(window) + [
+        types.Content(role="user", parts=[types.Part(text=build_enhanced_question(request.question, context))])
+    ]
+    config = types.GenerateContentConfig(
+        system_instruction=system_prompt,
+        temperature=0.7,
+    )
+    generation = Generation(contents, config, sources, models)
+
+    # The system prompt and the start of the course's materials are the same for every
+    # question about the course; Gemini caches them once and reads them cheaply after
+    if request.course_id and context_cache.supports(models[0]):
+        material = await get_course_material(request.course_id)
+        if material:
+            prefix = [
+                types.Content(role="user", parts=[types.Part(
+                    text=f"Course materials for reference:\n\n{material['text']}"
+                )]),
+                types.Content(role="model", parts=[types.Part(text="Understood.")])
+            ]
+            tokens = material["tokens"] + prefix_tokens(system_prompt)
+            generation.cached_content = await context_cache.get(models[0], system_prompt, prefix, tokens=tokens)
+            if generation.cached_content:
+                generation.cached_tokens = tokens
+    return generation
+
+# course_id -> (course version, material dict) for the most recently asked-about courses
+_course_materials = OrderedDict()
+
+def course_is_indexing(course_id):
+    """True while any of a course's files is waiting for or in ingestion"""
+    db = SessionLocal()
+    try:
+        return db.query(CourseFile.id).filter(
+            CourseFile.course_id == int(course_id), CourseFile.status == "queued"
+        ).first() is not None
+    finally:
+        db.close()
+
+async def get_course_material(course_id):
+    """
+    Start of a course's materials for the cached prompt prefix, or None
+
+    Read once per course version. Left out while the course's files are
+    being indexed: its version moves with every batch, and each new prefix
+    would be created as a new Gemini cache.
+    """
+    if not CONTEXT_CACHE_COURSE_TOKENS or not str(course_id).isdigit():
+        return None
+    key = str(course_id)
+    version = await asyncio.to_thread(get_version, key)
+    memo = _course_materials.get(key)
+    if memo is not None and memo[0] == version:
+        _course_materials.move_to_end(key)
+        return memo[1]
+    if await asyncio.to_thread(course_is_indexing, key):
+        return None
+
+    material = await retrieval_client.course_material(key, CONTEXT_CACHE_COURSE_TOKENS)
+    if material is None:
+        return None  # retrieval failed; try again on the next question
+    if not material.get("text"):
+        material = None
+    _course_materials[key] = (version, material)
+    _course_materials.move_to_end(key)
+    while len(_course_materials) > COURSE_MATERIAL_MEMO_SIZE:
+        _course_materials.popitem(last=False)
+    return material
+
+async def prepend_chunk(first, rest):
+    """Async iterator over first (unless None) followed by rest"""
+    if first is not None:
+        yield first
+    async for chunk in rest:
+        yield chunk
+
+async def generate(generation: Generation, stream=False):
+    """
+    Call Gemini through the rate-limit scheduler, falling back across models
+
+    Each routed model is tried in turn. The first one uses the context
+    cache when available and is retried uncached if Gemini rejects the
+    cache. Latency and failures are reported to the model router.
+
+    A stream is only returned once its first chunk has arrived, so errors
+    that Gemini reports when the request starts (429s, 5xx) are retried by
+    the scheduler and can fall back like unstreamed calls. Errors after
+    the first chunk end the stream.
+
+    Returns:
+        The response, or an async iterator of response chunks when stream=True
+    """
+    models = get_client().aio.models
+    tokens = estimate_request_tokens(generation.contents, generation.config.system_instruction)
+    last_model = generation.models[-1]
+
+    async def start(model, config):
+        if not stream:
+            return await models.generate_content(model=model, contents=generation.contents, config=config)
+        # The stream is lazy: the request is only sent when the first chunk is read
+        chunks = (await models.generate_content_stream(
+            model=model, contents=generation.contents, config=config
+        )).__aiter__()
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = None
+        return prepend_chunk(first, chunks)
+
+    async def call(model, config, fallback, tokens=tokens):
+        started = time.perf_counter()
+        try:
+            response = await scheduler.run(
+                model,
+                lambda: start(model, config),
+                tokens=tokens,
+                priority=generation.priority,
+                max_retries=None if model == last_model else FALLBACK_MAX_RETRIES
             )
+        except Exception as e:
+            model_router.record(
+                model, time.perf_counter() - started, ok=False,
+                rate_limited=is_rate_limited(e), fallback=fallback
+            )
+            raise
+        # For streams this is time to the first response chunk
+        model_router.record(model, time.perf_counter() - started, fallback=fallback)
+        return response
+
+    for i, model in enumerate(generation.models):
+        try:
+            if i == 0 and generation.cached_content:
+                cached_config = types.GenerateContentConfig(
+                    cached_content=generation.cached_content, temperature=generation.config.temperature
+                )
+                try:
+                    # Cached tokens still count towards the model's TPM limit
+                    return await call(model, cached_config, fallback=False, tokens=tokens + generation.cached_tokens)
+                except Exception as e:
+                    if is_rate_limited(e):
+                        raise
+                    print(f"⚠️ Generation with cached context failed ({type(e).__name__}: {e}); retrying uncached")
+                    context_cache.invalidate(generation.cached_content)
+            return await call(model, generation.config, fallback=i > 0)
+        except Exception as e:
+            if model == last_model:
+                raise
+            print(f"🔀 {model} failed ({type(e).__name__}: {e}); falling back to {generation.models[i + 1]}")
+
+def chat_error(e: Exception):
+    """Log a failed chat request and turn it into an HTTPException"""
+    import traceback
+    print("=" * 50)
+    print("FULL ERROR TRACEBACK:")
+    print(traceback.format_exc())
+    print("=" * 50)
+    if is_rate_limited(e):
+        # Retries are exhausted; tell the client when to try again
+        return HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded. Please try again in a moment.",
+            headers={"Retry-After": str(RATE_LIMIT_RETRY_AFTER)}
         )
-        
+    return HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+async def answer_events(request: ChatRequest, guardrail: str, window, ticket, stream: bool, priority=PRIORITY_STUDENT):
+    """
+    Generate an answer as (event, data) pairs: sources, token(s), done
+
+    Args:
+        request: Chat request
+        guardrail: The course's guardrail level
+        window: Session window (see load_session)
+        ticket: Answer cache ticket from lookup_cached_answer
+        stream: Stream tokens from Gemini as they arrive (otherwise one token event)
+        priority: Scheduler priority for the Gemini call (see get_priority)
+    """
+    generation = await prepare_generation(request, guardrail, window)
+    generation.priority = priority
+    yield "sources", {"sources": generation.sources}
+
+    if stream:
+        parts = []
+        async for chunk in await generate(generation, stream=True):
+            text = chunk.text
+            if text:
+                parts.append(text)
+                yield "token", {"text": text}
+        answer = "".join(parts)
+    else:
+        response = await generate(generation)
         answer = response.text
-        
-        return ChatResponse(answer=answer, sources=sources)
-        
+        yield "token", {"text": answer}
+
+    await remember_answer(request, guardrail, answer, generation.sources, ticket)
+    yield "done", {"answer": answer, "cached": False}
+
+async def chat_events(request: ChatRequest, window, stream: bool, priority=PRIORITY_STUDENT):
+    """
+    Events answering a chat request, from the answer cache or Gemini
+
+    Identical questions in flight at the same time (same course, subject,
+    guardrail level and normalized question, no session history) share one
+    retrieval and generation, queued at the priority of whoever asked
+    first; every requester receives all of its events.
+    """
+    guardrail = await asyncio.to_thread(get_guardrail_level, request.course_id)
+    # Cached answers only fit questions asked without earlier context
+    cached, ticket = await lookup_cached_answer(request, guardrail, window)
+    if cached:
+        events = [
+            ("sources", {"sources": cached["sources"]}),
+            ("token", {"text": cached["answer"]}),
+            ("done", {"answer": cached["answer"], "cached": True})
+        ]
+        for event in events:
+            yield event
+    elif COALESCE_ENABLED and (window is None or window.empty):
+        key = (
+            request.course_id, request.subject.lower(), guardrail,
+            normalize_question(request.question)
+        )
+        async for event in coalescer.subscribe(key, lambda: answer_events(request, guardrail, window, ticket, stream, priority)):
+            yield event
+    else:
+        async for event in answer_events(request, guardrail, window, ticket, stream, priority):
+            yield event
+
+@router.post("/api/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, user: Optional[dict] = Depends(get_chat_user)):
+    """
+    Main chat endpoint that combines Chroma retrieval with Gemini generation
+
+    Retrieval and generation are both awaited, so one worker can serve many
+    questions concurrently while they wait on Chroma and Gemini.
+    """
+    session_key = get_session_key(request.session_id, user)
+    try:
+        priority = get_priority(user)
+        window = await load_session(session_key, priority)
+        sources = []
+        async for event, data in chat_events(request, window, stream=False, priority=priority):
+            if event == "sources":
+                sources = data["sources"]
+            elif event == "done":
+                await record_turn(request, session_key, window, data["answer"])
+                return ChatResponse(answer=data["answer"], sources=sources, cached=data["cached"])
+        raise Exception("Answer generation ended without a result")
+
+    except Exception as e:
+        raise chat_error(e)
+
+def sse_event(event: str, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def event_stream(events):
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest, user: Optional[dict] = Depends(get_chat_user)):
+    """
+    Streaming variant of /api/chat (server-sent events)
+
+    Events, in order:
+        sources: {"sources": [...]} as soon as retrieval finishes
+        token:   {"text": "..."} for each piece of the answer as Gemini produces it
+        done:    {"answer": "<full answer>", "cached": false}
+    A cached answer is sent as a single token event. A failure after the
+    stream has started is sent as an "error" event ({"status": ...,
+    "detail": ...}) instead of an HTTP status.
+    """
+    session_key = get_session_key(request.session_id, user)
+    try:
+        priority = get_priority(user)
+        window = await load_session(session_key, priority)
+        events = chat_events(request, window, stream=True, priority=priority)
+        # Retrieval failures still get a proper HTTP status
+        first = await events.__anext__()
     except Exception as e:
-        import traceback
-        print("=" * 50)
-        print("FULL ERROR TRACEBACK:")
-        print(traceback.format_exc())
-        print("=" * 50)
-        if "429" in str(e):
-
-            time.sleep(2)
-            raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again in a moment.")
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+        raise chat_error(e)
+
+    async def relay():
+        yield sse_event(*first)
+        try:
+            async for event, data in events:
+                if event == "done":
+                    await record_turn(request, session_key, window, data["answer"])
+                yield sse_event(event, data)
+        except Exception as e:
+            error = chat_error(e)
+            yield sse_event("error", {"status": error.status_code, "detail": error.detail})
+
+    return event_stream(relay())
+
+@router.delete("/api/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str, user: Optional[dict] = Depends(get_chat_user)):
+    """Forget one of the signed-in user's chat sessions"""
+    deleted = await asyncio.to_thread(session_store.delete_session, get_session_key(session_id, user))
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"success": True, "message": "Session cleared"}
+
+@router.on_event("startup")
+def purge_expired_sessions():
+    purged = session_store.purge_expired()
+    if purged:
+        print(f"🧹 Removed {purged} expired chat sessions")
+
+@router.get("/api/chat/scheduler-stats")
+def scheduler_stats():
+    """Gemini queue depth, wait times and rate-limit retries per model"""
+    return {
+        "success": True,
+        "scheduler": scheduler.stats()
+    }
+
+@router.get("/api/chat/model-stats")
+def model_stats():
+    """Per-model routing counts, daily quota use and latency percentiles"""
+    return {
+        "success": True,
+        "router": model_router.stats()
+    }
+
+@router.get("/api/chat/cache-stats")
+def answer_cache_stats():
+    """Answer and context cache hit rates for this process"""
+    return {
+        "success": True,
+        "answer_cache": answer_cache.stats(),
+        "context_cache": context_cache.stats(),
+        "coalescer": coalescer.stats()
+    }
+
+app.include_router(router)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await retrieval_client.close()
 
 @app.get("/")
 def root():
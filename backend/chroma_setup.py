@@ -1,6 +1,8 @@
 import chromadb
 from pathlib import Path
 
+from embedding_cache import get_embedding_function
+
 # Initialize Chroma client (stores data locally)
 def init_chroma():
     """Initialize Chroma client with persistent storage"""
@@ -11,17 +13,25 @@ def init_chroma():
     return client
 
 # Create a collection (like a table in a database)
-def create_collection(client, name="course_content"):
-    """Create or get a Chroma collection"""
+def create_collection(client, name="course_content", embedding_function=None):
+    """
+    Create or get a Chroma collection
+    
+    Args:
+        client: Chroma client
+        name: Collection name
+        embedding_function: Defaults to the cached default embedding function
+    """
     # Just get or create - don't delete!
     collection = client.get_or_create_collection(
         name=name,
-        metadata={"hnsw:space": "cosine"}
+        metadata={"hnsw:space": "cosine"},
+        embedding_function=embedding_function or get_embedding_function()
     )
     return collection
 
 # Add documents to Chroma
-def add_to_chroma(collection, documents, ids, metadatas=None):
+def add_to_chroma(collection, documents, ids, metadatas=None, upsert=False, embeddings=None):
     """
     Add documents to Chroma collection
     
@@ -30,11 +40,15 @@ def add_to_chroma(collection, documents, ids, metadatas=None):
         documents: List of text strings
         ids: List of unique IDs for each document
         metadatas: Optional list of metadata dicts
+        upsert: Overwrite documents whose ids already exist instead of failing
+        embeddings: Optional precomputed vectors (skips the embedding function)
     """
-    collection.add(
+    write = collection.upsert if upsert else collection.add
+    write(
         documents=documents,
         ids=ids,
-        metadatas=metadatas or [{"source": "unknown"} for _ in documents]
+        metadatas=metadatas or [{"source": "unknown"} for _ in documents],
+        embeddings=embeddings
     )
     print(f"Added {len(documents)} documents to Chroma")
 
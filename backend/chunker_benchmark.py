@@ -0,0 +1,88 @@
+"""
+Compare the character splitter (chunk_text) with the sentence-aware
+token chunker (chunk_text_by_tokens) on real PDFs.
+
+Reports chunk counts, chunking speed and retrieval hit rate. Hit rate uses
+synthetic questions: sentences sampled from the document are used as
+queries, and a query counts as a hit when one of the top-k retrieved
+chunks contains the whole sentence (i.e. the answer span wasn't split).
+
+Usage:
+    python chunker_benchmark.py [pdf ...] [--queries 100] [--k 3]
+"""
+import argparse
+import random
+import re
+import time
+from pathlib import Path
+
+import chromadb
+
+from pdf_extractor import extract_pdf_pages
+from text_chunker import PAGE_SEPARATOR, chunk_text, chunk_text_by_tokens, estimate_tokens
+
+DEFAULT_PDFS = sorted(Path(__file__).resolve().parent.parent.glob("RAG/data/*.pdf"))
+
+CHUNKERS = {
+    "chars-500-50": lambda text: chunk_text(text, chunk_size=500, overlap=50),
+    "sentences-160-24": lambda text: chunk_text_by_tokens(text, max_tokens=160, overlap_tokens=24),
+}
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def sample_questions(text, n, seed=0):
+    """Pick n medium-length sentences from the text to use as queries"""
+    sentences = [
+        s for s in (_normalize(s) for s in re.split(r"(?<=[.!?])\s+", text))
+        if 8 <= len(s.split()) <= 30
+    ]
+    random.Random(seed).shuffle(sentences)
+    return sentences[:n]
+
+def time_chunker(chunker, text, repeat=5):
+    """Best-of-n wall time for chunking the text"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        chunks = chunker(text)
+        best = min(best, time.perf_counter() - t0)
+    return chunks, best
+
+def hit_rate(chunks, questions, k):
+    """Fraction of questions whose sentence is fully inside a top-k chunk"""
+    client = chromadb.EphemeralClient()
+    name = f"bench_{random.randrange(1 << 30)}"
+    collection = client.create_collection(name=name, metadata={"hnsw:space": "cosine"})
+    collection.add(documents=chunks, ids=[str(i) for i in range(len(chunks))])
+
+    results = collection.query(query_texts=questions, n_results=min(k, len(chunks)))
+    hits = 0
+    for question, docs in zip(questions, results["documents"]):
+        if any(question in _normalize(doc) for doc in docs):
+            hits += 1
+    client.delete_collection(name)
+    return hits / len(questions) if questions else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", type=Path, default=DEFAULT_PDFS)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    for pdf in args.pdfs:
+        pages = extract_pdf_pages(pdf)
+        text = PAGE_SEPARATOR.join(pages)
+        questions = sample_questions(text, args.queries)
+
+        print(f"\n{pdf.name}: {len(pages)} pages, {len(text)} chars, {len(questions)} queries")
+        print(f"{'chunker':<20}{'chunks':>8}{'avg tok':>9}{'ms':>9}{f'hit@{args.k}':>9}")
+        for name, chunker in CHUNKERS.items():
+            chunks, elapsed = time_chunker(chunker, text)
+            avg_tokens = sum(estimate_tokens(c) for c in chunks) / len(chunks)
+            rate = hit_rate(chunks, questions, args.k)
+            print(f"{name:<20}{len(chunks):>8}{avg_tokens:>9.0f}{elapsed * 1000:>9.1f}{rate:>9.1%}")
+
+if __name__ == "__main__":
+    main()
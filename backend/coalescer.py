@@ -0,0 +1,100 @@
+import asyncio
+from collections import Counter
+
+class _Flight:
+    """One in-progress upstream call and the items it has produced so far"""
+
+    def __init__(self):
+        self.items = []
+        self.finished = False
+        self.error = None
+        self._cond = asyncio.Condition()
+
+    async def publish(self, item):
+        async with self._cond:
+            self.items.append(item)
+            self._cond.notify_all()
+
+    async def finish(self, error=None):
+        async with self._cond:
+            self.error = error
+            self.finished = True
+            self._cond.notify_all()
+
+    async def subscribe(self):
+        """Replay everything produced so far, then follow along until the end"""
+        seen = 0
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: seen < len(self.items) or self.finished)
+                batch = self.items[seen:]
+                finished = self.finished
+            for item in batch:
+                yield item
+            seen += len(batch)
+            if finished and seen >= len(self.items):
+                if self.error is not None:
+                    raise self.error
+                return
+
+class Coalescer:
+    """
+    Single-flight for identical concurrent requests
+
+    The first request for a key starts produce() in a background task; any
+    request with the same key that arrives while it is still running
+    subscribes to the same flight instead of starting its own. Every
+    subscriber receives every item (including ones produced before it
+    joined), so streamed results fan out to all waiters. The background
+    task keeps running if the first requester disconnects. Once the flight
+    finishes, the next request for the key starts a new one.
+    """
+    def __init__(self):
+        self._flights = {}
+        self._tasks = set()
+        self.counts = Counter()
+
+    def subscribe(self, key, produce):
+        """
+        Items of the flight for key, starting one with produce() if none is running
+
+        Args:
+            key: Hashable identity of the request
+            produce: Zero-argument function returning an async iterator of items
+
+        Returns:
+            Async iterator over the flight's items; raises the producer's
+            exception (if any) after the last item
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            task = asyncio.create_task(self._run(key, flight, produce))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            self.counts["started"] += 1
+        else:
+            self.counts["coalesced"] += 1
+        return flight.subscribe()
+
+    async def _run(self, key, flight, produce):
+        error = None
+        try:
+            async for item in produce():
+                await flight.publish(item)
+        except Exception as e:
+            error = e
+        finally:
+            # Later requests start a fresh flight
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            await flight.finish(error)
+
+    def stats(self):
+        total = self.counts["started"] + self.counts["coalesced"]
+        return {
+            "started": self.counts["started"],
+            "coalesced": self.counts["coalesced"],
+            "coalesced_rate": round(self.counts["coalesced"] / total, 4) if total else None,
+            "in_flight": len(self._flights)
+        }
@@ -0,0 +1,229 @@
+"""
+Gemini context caching for the fixed part of chat prompts
+
+Chat questions about a course share a prefix: the system instruction
+(subject and guardrail level) followed by the start of the course's
+materials (see retrieval.course_material). ContextCache creates a
+provider-side cached content for such a prefix once, hands its name to
+generate_content (config.cached_content) on later requests, and keeps it
+alive while it is in use. Prefixes are identified by their content, so a
+course's prefix changes (and is cached anew) only when its materials do.
+
+Retrieved passages are not part of the prefix: they differ for every
+question. Gemini only caches prefixes of a minimum size
+(CONTEXT_CACHE_MIN_TOKENS) and not on every model, so smaller prefixes and
+unsupported models are sent uncached without trying. When a create fails
+anyway (quota, network errors) the prefix is not retried for a while.
+
+Run this file for a demo against a local stub of the Gemini client:
+    python context_cache.py
+"""
+import asyncio
+import hashlib
+import os
+import time
+import weakref
+from collections import Counter
+
+from google.genai import types
+
+from context_packer import parse_budgets
+from text_chunker import estimate_tokens
+
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+# Lifetime of a cached prefix on Gemini's side; extended while requests keep using it
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "3600"))
+# Extend the TTL when less than this many seconds remain
+CONTEXT_CACHE_REFRESH_MARGIN = int(os.getenv("CONTEXT_CACHE_REFRESH_MARGIN", "300"))
+# After a failed create, send that prefix uncached for this long before retrying
+CONTEXT_CACHE_RETRY_AFTER = int(os.getenv("CONTEXT_CACHE_RETRY_AFTER", "600"))
+# Smallest prefix Gemini will cache, per model ("model=tokens,..."); others get the default
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "1024"))
+CONTEXT_CACHE_MIN_TOKENS_BY_MODEL = os.getenv("CONTEXT_CACHE_MIN_TOKENS_BY_MODEL", "gemini-2.5-pro=4096")
+# Models without explicit caching support (experimental releases)
+CONTEXT_CACHE_UNSUPPORTED_MODELS = {
+    model.strip() for model in os.getenv("CONTEXT_CACHE_UNSUPPORTED_MODELS", "gemini-2.0-flash-exp").split(",") if model.strip()
+}
+
+_min_tokens = parse_budgets(CONTEXT_CACHE_MIN_TOKENS_BY_MODEL)
+
+def min_cache_tokens(model):
+    """Smallest prefix (in tokens) Gemini caches for a model"""
+    return _min_tokens.get(model, CONTEXT_CACHE_MIN_TOKENS)
+
+def prefix_key(system_instruction, contents=None):
+    """Content hash identifying a prompt prefix"""
+    sha = hashlib.sha256(system_instruction.encode("utf-8"))
+    for content in contents or []:
+        for part in content.parts or []:
+            sha.update(b"\0" + (part.text or "").encode("utf-8"))
+    return sha.hexdigest()
+
+def prefix_tokens(system_instruction, contents=None):
+    """Estimated tokens of a prompt prefix"""
+    texts = [system_instruction] + [part.text or "" for content in contents or [] for part in content.parts or []]
+    return sum(estimate_tokens(text) for text in texts)
+
+class ContextCache:
+    """
+    Provider-side cached contents, one per (model, prefix content)
+
+    Args:
+        client: genai.Client (or a compatible stub), or a callable returning one
+        ttl: Seconds a cached content lives without being refreshed
+        enabled: Turn caching off entirely (every lookup returns None)
+    """
+    def __init__(self, client=None, ttl=None, enabled=None):
+        self._client = client
+        self.ttl = ttl or CONTEXT_CACHE_TTL
+        self.enabled = CONTEXT_CACHE_ENABLED if enabled is None else enabled
+        self._entries = {}  # (model, prefix hash) -> {"name", "expires_at"}
+        self._failed = {}  # (model, prefix hash) -> time of last failure
+        # Held only while a create/refresh is running or awaited
+        self._locks = weakref.WeakValueDictionary()
+        self.counts = Counter()
+
+    def _caches(self):
+        client = self._client() if callable(self._client) else self._client
+        return client.aio.caches
+
+    def supports(self, model):
+        """False if no prefix is ever cached for this model (caching off or unsupported)"""
+        return self.enabled and model not in CONTEXT_CACHE_UNSUPPORTED_MODELS
+
+    async def get(self, model, system_instruction, contents=None, tokens=None):
+        """
+        Name of a live cached content for this prefix, creating it if needed
+
+        Args:
+            model: Model the cache is used with (caches are model-specific)
+            system_instruction: System prompt to cache
+            contents: Optional fixed contents following the system prompt
+            tokens: Size of the prefix if known (estimated otherwise)
+
+        Returns:
+            The cached content name, or None to send the prompt uncached
+        """
+        if not self.supports(model):
+            return None
+        if tokens is None:
+            tokens = prefix_tokens(system_instruction, contents)
+        if tokens < min_cache_tokens(model):
+            self.counts["ineligible"] += 1
+            return None
+
+        key = prefix_key(system_instruction, contents)
+        cache_key = (model, key)
+        failed_at = self._failed.get(cache_key)
+        if failed_at is not None and time.time() - failed_at < CONTEXT_CACHE_RETRY_AFTER:
+            self.counts["skipped"] += 1
+            return None
+
+        # One create/refresh per prefix at a time; other requests wait for it
+        lock = self._locks.get(cache_key)
+        if lock is None:
+            lock = self._locks[cache_key] = asyncio.Lock()
+        async with lock:
+            entry = self._entries.get(cache_key)
+            now = time.time()
+            if entry is not None and entry["expires_at"] - now > CONTEXT_CACHE_REFRESH_MARGIN:
+                self.counts["hits"] += 1
+                return entry["name"]
+
+            try:
+                if entry is not None and entry["expires_at"] > now:
+                    await self._caches().update(
+                        name=entry["name"],
+                        config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s")
+                    )
+                    self.counts["refreshes"] += 1
+                else:
+                    created = await self._caches().create(
+                        model=model,
+                        config=types.CreateCachedContentConfig(
+                            system_instruction=system_instruction,
+                            contents=contents,
+                            display_name=f"aita-{key[:16]}",
+                            ttl=f"{self.ttl}s"
+                        )
+                    )
+                    entry = {"name": created.name}
+                    self.counts["creates"] += 1
+                    self._forget_expired(now)
+                    print(f"🗄️ Created Gemini context cache {created.name} for prefix {key[:16]}")  # DEBUG
+            except Exception as e:
+                self._entries.pop(cache_key, None)
+                self._forget_expired(now)
+                self._failed[cache_key] = time.time()
+                self.counts["failures"] += 1
+                print(f"⚠️ Context cache unavailable for prefix {key[:16]}: {type(e).__name__}: {e}")
+                return None
+
+            entry["expires_at"] = time.time() + self.ttl
+            self._entries[cache_key] = entry
+            self._failed.pop(cache_key, None)
+            return entry["name"]
+
+    def _forget_expired(self, now):
+        """Drop entries Gemini has already deleted and failures old enough to retry"""
+        for cache_key, entry in list(self._entries.items()):
+            if entry["expires_at"] <= now:
+                del self._entries[cache_key]
+        for cache_key, failed_at in list(self._failed.items()):
+            if now - failed_at >= CONTEXT_CACHE_RETRY_AFTER:
+                del self._failed[cache_key]
+
+    def invalidate(self, name):
+        """Forget a cached content that Gemini rejected (e.g. expired early)"""
+        for cache_key, entry in list(self._entries.items()):
+            if entry["name"] == name:
+                del self._entries[cache_key]
+                self.counts["invalidated"] += 1
+
+    def stats(self):
+        lookups = self.counts["hits"] + self.counts["creates"] + self.counts["refreshes"]
+        return {
+            "enabled": self.enabled,
+            "hits": self.counts["hits"],
+            "creates": self.counts["creates"],
+            "refreshes": self.counts["refreshes"],
+            "failures": self.counts["failures"],
+            "skipped": self.counts["skipped"],
+            "ineligible": self.counts["ineligible"],
+            "invalidated": self.counts["invalidated"],
+            "hit_rate": round(self.counts["hits"] / lookups, 4) if lookups else None,
+            "live_caches": len(self._entries)
+        }
+
+if __name__ == "__main__":
+    from types import SimpleNamespace
+
+    class StubCaches:
+        """Stands in for client.aio.caches; records calls instead of calling Gemini"""
+        def __init__(self):
+            self.calls = []
+
+        async def create(self, model, config):
+            self.calls.append("create")
+            return SimpleNamespace(name=f"cachedContents/{len(self.calls)}")
+
+        async def update(self, name, config):
+            self.calls.append("update")
+
+    stub = StubCaches()
+    cache = ContextCache(client=SimpleNamespace(aio=SimpleNamespace(caches=stub)), ttl=400)
+
+    async def demo():
+        prompt = "You are a tutor. Explain each step and never give the final answer."
+        material = [types.Content(role="user", parts=[types.Part(
+            text="Course materials:\n" + "A Turing machine reads and writes symbols on a tape. " * 150
+        )])]
+        print("prompt only:", await cache.get("gemini-2.5-flash-lite", prompt), "calls:", stub.calls)
+        print("unsupported model:", await cache.get("gemini-2.0-flash-exp", prompt, material), "calls:", stub.calls)
+        names = await asyncio.gather(*[cache.get("gemini-2.5-flash-lite", prompt, material) for _ in range(5)])
+        print("concurrent lookups:", names, "calls:", stub.calls)
+        cache._entries[("gemini-2.5-flash-lite", prefix_key(prompt, material))]["expires_at"] = time.time() + 60
+        print("near expiry:", await cache.get("gemini-2.5-flash-lite", prompt, material), "calls:", stub.calls)
+        print(cache.stats())
+
+    asyncio.run(demo())
@@ -0,0 +1,167 @@
+import os
+
+from text_chunker import estimate_tokens
+
+# Course-material tokens allowed in a chat prompt, per model
+# ("model=tokens,..."); models not listed get CONTEXT_TOKEN_BUDGET
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_TOKEN_BUDGETS = os.getenv(
+    "CONTEXT_TOKEN_BUDGETS",
+    "gemini-2.5-flash=2500,gemini-2.0-flash-exp=1500,gemini-2.5-flash-lite=1000"
+)
+# A source that doesn't fit is cut down if at least this many tokens are left, else skipped
+MIN_PARTIAL_TOKENS = int(os.getenv("MIN_PARTIAL_TOKENS", "60"))
+
+# Shortest repeated text treated as chunk overlap rather than coincidence
+_MIN_OVERLAP_CHARS = 20
+# Longest overlap looked for (chunk overlaps are 50 characters or 24 tokens)
+_MAX_OVERLAP_CHARS = 1000
+# Marks a passage that was cut short
+_ELLIPSIS = " …"
+
+def parse_budgets(spec):
+    """Parse "model=tokens,..." into {model: tokens}"""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, tokens = item.partition("=")
+        budgets[model.strip()] = int(tokens)
+    return budgets
+
+_budgets = parse_budgets(CONTEXT_TOKEN_BUDGETS)
+
+def token_budget_for(model):
+    """Context token budget of a model"""
+    return _budgets.get(model, CONTEXT_TOKEN_BUDGET)
+
+def strip_overlap(previous, text):
+    """
+    Remove the start of text that repeats the end of previous
+
+    Consecutive chunks of a file share their boundary text; merging them
+    should keep it once.
+    """
+    head = text[:_MIN_OVERLAP_CHARS]
+    if len(head) < _MIN_OVERLAP_CHARS:
+        return text
+    tail_start = max(0, len(previous) - _MAX_OVERLAP_CHARS)
+    position = previous.find(head, tail_start)
+    while position != -1:
+        # Longest overlap first: the earliest match that runs to the end of previous
+        if text.startswith(previous[position:]):
+            return text[len(previous) - position:]
+        position = previous.find(head, position + 1)
+    return text
+
+def truncate_to_tokens(text, max_tokens):
+    """Longest prefix of text within max_tokens, cut back to a sentence end if one is near"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # The ellipsis counts towards max_tokens too
+    max_tokens -= estimate_tokens(_ELLIPSIS)
+    if max_tokens <= 0:
+        return ""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text[:low]
+    sentence_end = max(cut.rfind(". "), cut.rfind(".\n"), cut.rfind("\n\n"))
+    if sentence_end > len(cut) // 2:
+        cut = cut[:sentence_end + 1]
+    return cut.rstrip() + _ELLIPSIS
+
+def _chunk_position(metadata):
+    file_id = metadata.get("file_id")
+    chunk_id = metadata.get("chunk_id")
+    if file_id is None or not isinstance(chunk_id, int):
+        return None
+    return file_id, chunk_id
+
+def merge_adjacent(results):
+    """
+    Join search results that are consecutive chunks of the same file
+
+    Args:
+        results: Search results (dicts with "content", "metadata", "rank")
+
+    Returns:
+        Passages (dicts with "content", "metadata" of the first chunk,
+        "chunk_ids" and the best "rank" of their chunks), best rank first
+    """
+    passages = []
+    by_file = {}
+    for i, result in enumerate(results):
+        result = {**result, "rank": result.get("rank") or i + 1}
+        metadata = result.get("metadata") or {}
+        position = _chunk_position(metadata)
+        if position is None:
+            passages.append({
+                "content": result.get("content", ""),
+                "metadata": metadata,
+                "chunk_ids": [metadata.get("chunk_id")],
+                "rank": result["rank"]
+            })
+        else:
+            by_file.setdefault(position[0], []).append((position[1], result))
+
+    for chunks in by_file.values():
+        chunks.sort(key=lambda chunk: chunk[0])
+        passage = None
+        for chunk_id, result in chunks:
+            if passage is not None and chunk_id == passage["chunk_ids"][-1] + 1:
+                text = result.get("content", "")
+                rest = strip_overlap(passage["content"], text)
+                # Chunks are stripped; without overlap the whitespace between them is gone
+                passage["content"] += rest if len(rest) < len(text) else " " + text
+                passage["chunk_ids"].append(chunk_id)
+                passage["rank"] = min(passage["rank"], result["rank"])
+                continue
+            if passage is not None and chunk_id == passage["chunk_ids"][-1]:
+                continue  # same chunk returned twice
+            passage = {
+                "content": result.get("content", ""),
+                "metadata": result.get("metadata") or {},
+                "chunk_ids": [chunk_id],
+                "rank": result["rank"]
+            }
+            passages.append(passage)
+
+    passages.sort(key=lambda passage: passage["rank"])
+    return passages
+
+def pack_context(results, token_budget=None):
+    """
+    Assemble retrieved chunks into prompt context within a token budget
+
+    Consecutive chunks of the same file are merged with their overlap
+    removed, passages are ordered by their best retrieval rank, and
+    passages are added until the budget is used up (the last one is cut
+    short if enough room is left for it to be useful).
+
+    Args:
+        results: Search results, as returned by /api/query-chroma
+        token_budget: Most tokens of course material to include
+
+    Returns:
+        (list of passages that fit, tokens used); each passage has
+        "content", "metadata", "chunk_ids" and "tokens"
+    """
+    token_budget = token_budget or CONTEXT_TOKEN_BUDGET
+    packed = []
+    used = 0
+    for passage in merge_adjacent(results):
+        tokens = estimate_tokens(passage["content"])
+        remaining = token_budget - used
+        if tokens > remaining:
+            if remaining < MIN_PARTIAL_TOKENS and packed:
+                continue
+            passage["content"] = truncate_to_tokens(passage["content"], remaining)
+            tokens = estimate_tokens(passage["content"])
+            if not tokens:
+                continue
+        packed.append({**passage, "tokens": tokens})
+        used += tokens
+    return packed, used
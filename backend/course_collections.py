@@ -0,0 +1,131 @@
+import os
+
+from chroma_setup import create_collection
+from course_versions import bump_legacy_version, bump_version
+from embedding_cache import get_embedding_function
+
+# Chunks not tied to a course (POST /api/store-in-chroma) stay in the
+# original global collection; every course gets its own collection, so
+# per-course searches walk a small HNSW graph instead of filtering a
+# global one.
+LEGACY_COLLECTION = os.getenv("LEGACY_COLLECTION", "course_materials")
+COURSE_COLLECTION_PREFIX = "course_"
+
+# Chunks moved per call while migrating the global collection
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "256"))
+
+def course_collection_name(course_id):
+    return f"{COURSE_COLLECTION_PREFIX}{course_id}"
+
+class CourseCollections:
+    """
+    Routes reads and writes to the Chroma collection of each course
+
+    A course's collection is created on its first ingest and kept after
+    its last file is removed: an empty collection costs next to nothing,
+    while dropping it would invalidate the handles that running ingest
+    jobs and the standalone chat service's CourseCollections hold on it.
+    Courses themselves can't be deleted yet; whatever deletes one should
+    also delete course_collection_name(course_id) and its keyword index.
+
+    Args:
+        client: Chroma client
+        legacy_name: Collection holding chunks that have no course
+    """
+    def __init__(self, client, legacy_name=None):
+        self.client = client
+        self.legacy = create_collection(client, legacy_name or LEGACY_COLLECTION)
+        self._collections = {}
+
+    def for_course(self, course_id, create=True):
+        """
+        Collection of a course's chunks
+
+        Args:
+            course_id: Course ID (None: chunks not tied to a course)
+            create: Create the collection if the course has none yet; with
+                False, a course that was never indexed returns None
+
+        Returns:
+            Chroma collection, or None
+        """
+        if not course_id:
+            return self.legacy
+        name = course_collection_name(course_id)
+        collection = self._collections.get(name)
+        if collection is None:
+            if create:
+                collection = create_collection(self.client, name)
+            else:
+                try:
+                    collection = self.client.get_collection(name, embedding_function=get_embedding_function())
+                except Exception:
+                    # Read of a course that has nothing indexed; don't create an empty collection for it
+                    return None
+            self._collections[name] = collection
+        return collection
+
+    def partitions(self):
+        """(course_id, collection) for the legacy collection and every course collection"""
+        yield None, self.legacy
+        for collection in self.client.list_collections():
+            name = collection.name
+            if name.startswith(COURSE_COLLECTION_PREFIX) and name[len(COURSE_COLLECTION_PREFIX):].isdigit():
+                course_id = name[len(COURSE_COLLECTION_PREFIX):]
+                yield course_id, self.for_course(course_id, create=False)
+
+    def count(self):
+        """Chunks across every collection"""
+        return sum(collection.count() for _, collection in self.partitions() if collection is not None)
+
+    def migrate(self):
+        """
+        Move course chunks out of the legacy global collection
+
+        Chunks with a course_id are copied (with their vectors) into that
+        course's collection and then deleted from the global one, so an
+        interrupted migration just resumes on the next start. Chunks
+        without a course_id stay where they are.
+
+        Runs synchronously at startup, before requests are served: until
+        it finishes, per-course searches and file deletes would miss the
+        chunks still in the global collection. Moving is a one-time cost
+        (vectors are copied, nothing is re-embedded); later starts only
+        read the metadata of the few chunks left without a course.
+
+        Returns:
+            Number of chunks moved
+        """
+        by_course = {}
+        offset = 0
+        while True:
+            page = self.legacy.get(include=["metadatas"], limit=MIGRATION_BATCH_SIZE, offset=offset)
+            for chunk_id, metadata in zip(page["ids"], page["metadatas"]):
+                course_id = (metadata or {}).get("course_id")
+                if course_id:
+                    by_course.setdefault(course_id, []).append(chunk_id)
+            if len(page["ids"]) < MIGRATION_BATCH_SIZE:
+                break
+            offset += MIGRATION_BATCH_SIZE
+
+        moved = 0
+        for course_id, chunk_ids in by_course.items():
+            target = self.for_course(course_id)
+            for start in range(0, len(chunk_ids), MIGRATION_BATCH_SIZE):
+                batch = self.legacy.get(
+                    ids=chunk_ids[start:start + MIGRATION_BATCH_SIZE],
+                    include=["documents", "embeddings", "metadatas"]
+                )
+                target.upsert(
+                    ids=batch["ids"],
+                    documents=batch["documents"],
+                    embeddings=batch["embeddings"],
+                    metadatas=batch["metadatas"]
+                )
+                self.legacy.delete(ids=batch["ids"])
+                moved += len(batch["ids"])
+            bump_version(course_id)
+            print(f"🚚 Moved {len(chunk_ids)} chunks of course {course_id} to {course_collection_name(course_id)}")
+        if moved:
+            bump_legacy_version()
+        return moved
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import threading
+
+# Per-course version counters, bumped whenever a course's chunks change.
+# Caches (answers, retrieval results) store the version they were built
+# against and treat an entry as stale once the counter has moved on.
+# Kept in SQLite so the backend and a separately running chat service agree.
+COURSE_VERSIONS_PATH = os.getenv("COURSE_VERSIONS_PATH", "course_versions.db")
+
+# Key for searches that are not filtered by course; bumped on every change
+ALL_COURSES = "*"
+# Key for chunks not tied to a course (the legacy collection); bumped only when they change
+LEGACY_CHUNKS = "legacy"
+
+_lock = threading.Lock()
+_conn = None
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(COURSE_VERSIONS_PATH, check_same_thread=False, timeout=30)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS course_versions ("
+            " course_key TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        _conn.commit()
+    return _conn
+
+def _key(course_id):
+    # An empty course_id ("?course_id=") searches every course, like None
+    return str(course_id) if course_id else ALL_COURSES
+
+def _get(key):
+    with _lock:
+        row = _get_conn().execute(
+            "SELECT version FROM course_versions WHERE course_key = ?", (key,)
+        ).fetchone()
+    return row[0] if row else 0
+
+def get_version(course_id=None):
+    """Current version of a course's materials (course_id=None: all courses)"""
+    return _get(_key(course_id))
+
+def get_legacy_version():
+    """Current version of the chunks not tied to a course"""
+    return _get(LEGACY_CHUNKS)
+
+def bump_version(course_id=None):
+    """
+    Record that a course's chunks changed
+
+    Also bumps the all-courses counter, since unfiltered searches see every
+    course's chunks.
+    """
+    _bump({_key(course_id), ALL_COURSES})
+
+def bump_legacy_version():
+    """Record that chunks not tied to a course changed (store-in-chroma, migration)"""
+    _bump({LEGACY_CHUNKS, ALL_COURSES})
+
+def _bump(keys):
+    with _lock:
+        conn = _get_conn()
+        for key in keys:
+            conn.execute(
+                "INSERT INTO course_versions (course_key, version) VALUES (?, 1) "
+                "ON CONFLICT(course_key) DO UPDATE SET version = version + 1",
+                (key,)
+            )
+        conn.commit()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -38,6 +38,7 @@ class Course(Base):
     # Relationships
     teacher = relationship("User", back_populates="courses_teaching")
     enrollments = relationship("Enrollment", back_populates="course")
+    files = relationship("CourseFile", back_populates="course")
 
 class Enrollment(Base):
     __tablename__ = "enrollments"
@@ -51,6 +52,45 @@ class Enrollment(Base):
     course = relationship("Course", back_populates="enrollments")
     student = relationship("User", back_populates="enrollments")
 
+class StoredFile(Base):
+    __tablename__ = "stored_files"
+    
+    id = Column(String, primary_key=True, index=True)  # sha256 of the file bytes (uploads/<id>.pdf)
+    filename = Column(String, nullable=True)  # name it was first uploaded under
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, default=0)  # number of courses using this file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class CourseFile(Base):
+    __tablename__ = "course_files"
+    __table_args__ = (UniqueConstraint("course_id", "file_id"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=False, index=True)
+    file_id = Column(String, nullable=False)  # content hash (uploads/<file_id>.pdf)
+    filename = Column(String, nullable=True)
+    status = Column(String, default="queued")  # queued, indexed, failed
+    num_chunks = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    course = relationship("Course", back_populates="files")
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+    
+    id = Column(String, primary_key=True, index=True)  # uuid4
+    kind = Column(String, nullable=False)  # handler name, e.g. "ingest_course_file"
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=True, index=True)
+    file_id = Column(String, nullable=False)
+    course_file_id = Column(Integer, ForeignKey("course_files.id"), nullable=True)
+    status = Column(String, default="queued")  # queued, running, completed, failed, cancelling, cancelled
+    progress = Column(Integer, default=0)  # chunks stored so far
+    total = Column(Integer, default=0)  # chunks to store (0 until known)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # Create tables
 def init_db():
     Base.metadata.create_all(bind=engine)
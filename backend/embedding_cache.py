@@ -0,0 +1,143 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+# On-disk vector cache shared by every process on this machine
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """
+    Chroma's default embedding function with a persistent LRU cache
+
+    Vectors are stored in SQLite keyed by a hash of the text, so identical
+    chunk text across courses and repeated student questions are only
+    embedded once. It produces exactly the default function's vectors, so
+    it reports the same name/config and existing collections keep working.
+    (It wraps rather than subclasses DefaultEmbeddingFunction: Chroma
+    bypasses any instance of that class in favour of its own.)
+    """
+    def __init__(self, path=None, max_entries=None, inner=None):
+        self._inner = inner or DefaultEmbeddingFunction()
+        self.path = path or EMBEDDING_CACHE_PATH
+        self.max_entries = max_entries or EMBEDDING_CACHE_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def __call__(self, input):
+        keys = [self._key(text) for text in input]
+        now = time.time()
+        found = {}
+
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            for start in range(0, len(unique_keys), _SQL_BATCH):
+                batch = unique_keys[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).copy()
+                # Mark hits as recently used
+                self._conn.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})", [now, *batch]
+                )
+            self._conn.commit()
+
+        # Embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, input):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self.hits += len(keys) - sum(1 for key in keys if key in missing)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = self._inner(list(missing.values()))
+            new_rows = []
+            for key, vector in zip(missing.keys(), vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                found[key] = vector
+                new_rows.append((key, vector.tobytes(), now))
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", new_rows
+                )
+                self._conn.commit()
+                self._entries += len(new_rows)
+                if self._entries > self.max_entries:
+                    self._evict()
+
+        return [found[key] for key in keys]
+
+    @staticmethod
+    def name():
+        return DefaultEmbeddingFunction.name()
+
+    def get_config(self):
+        return {}
+
+    @staticmethod
+    def build_from_config(config):
+        return get_embedding_function()
+
+    def _evict(self):
+        """Drop least recently used vectors down to 90% of max_entries (lock held)"""
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._entries - int(self.max_entries * 0.9)
+        if excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self._conn.commit()
+        self._entries -= excess
+        self.evictions += excess
+
+    def stats(self):
+        """Hit/miss counters for this process"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "entries": self._entries,
+            "max_entries": self.max_entries
+        }
+
+_default = None
+
+def get_embedding_function():
+    """Process-wide cached embedding function"""
+    global _default
+    if _default is None:
+        _default = CachedEmbeddingFunction()
+    return _default
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import re
+import uuid
+from pathlib import Path
+
+from pdf_extractor import iter_pdf_pages
+from text_chunker import chunk_text, iter_chunks
+
+# Persistent cache of extracted page text and chunk lists
+CACHE_DIR = Path(os.getenv("EXTRACTION_CACHE_DIR", "extraction_cache"))
+CACHE_DIR.mkdir(exist_ok=True)
+
+# Disk budget; least recently used entries are evicted beyond this
+CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Bump whenever extraction output changes so stale entries are ignored
+EXTRACTOR_VERSION = "pypdf2-v1"
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Legacy (uuid4-named) files: (path, size, mtime) -> content hash
+_legacy_hashes = {}
+
+# Cache stats since process start
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def file_hash(file_id, file_path):
+    """
+    Content hash of an uploaded file
+
+    Content-addressed uploads already use their sha256 as file_id; legacy
+    uuid4 uploads are hashed once and remembered.
+    """
+    if _SHA256_RE.match(file_id):
+        return file_id
+
+    st = os.stat(file_path)
+    key = (str(file_path), st.st_size, st.st_mtime)
+    if key not in _legacy_hashes:
+        sha = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(block)
+        _legacy_hashes[key] = sha.hexdigest()
+    return _legacy_hashes[key]
+
+def _read(name):
+    path = CACHE_DIR / name
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            value = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        stats["misses"] += 1
+        return None
+    # Touch so eviction sees this entry as recently used
+    os.utime(path)
+    stats["hits"] += 1
+    return value
+
+def _stream(name, produce):
+    """
+    Yield a cached list item by item, or produce it and cache it on the way
+
+    On a miss, items from produce() are written to a temp file as they are
+    yielded, so nothing has to be held in memory; the entry only becomes
+    visible once the producer is exhausted.
+    """
+    cached = _read(name)
+    if cached is not None:
+        yield from cached
+        return
+
+    tmp_path = CACHE_DIR / f".{uuid.uuid4()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("[")
+            for i, item in enumerate(produce()):
+                f.write(("," if i else "") + json.dumps(item))
+                yield item
+            f.write("]")
+        os.replace(tmp_path, CACHE_DIR / name)
+    finally:
+        # Producer failed or the consumer stopped early
+        tmp_path.unlink(missing_ok=True)
+    evict()
+
+def evict(max_bytes=None):
+    """Delete least recently used entries until the cache fits its disk budget"""
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    total = 0
+    for path in CACHE_DIR.glob("*.json"):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        stats["evictions"] += 1
+
+def iter_pages(file_id, file_path):
+    """
+    Stream page texts of a PDF, parsed at most once per file content
+
+    Args:
+        file_id: Upload id (content hash or legacy uuid)
+        file_path: Path to the PDF
+
+    Yields:
+        Page text strings, in order
+    """
+    name = f"pages-{file_hash(file_id, file_path)}-{EXTRACTOR_VERSION}.json"
+    return _stream(name, lambda: iter_pdf_pages(file_path))
+
+def get_pages(file_id, file_path):
+    """List of page texts of a PDF (see iter_pages)"""
+    return list(iter_pages(file_id, file_path))
+
+def iter_file_chunks(file_id, file_path, chunk_size=500, overlap=50, strategy="chars"):
+    """
+    Stream chunks of a PDF's text for the given chunker parameters
+
+    With the "sentences" strategy and a cold cache, chunks are yielded while
+    later pages are still being extracted.
+
+    Args:
+        file_id: Upload id (content hash or legacy uuid)
+        file_path: Path to the PDF
+        chunk_size: Chunk size (characters for "chars", tokens for "sentences")
+        overlap: Overlap between chunks, in the same unit
+        strategy: "chars" (chunk_text) or "sentences" (chunk_text_by_tokens)
+
+    Yields:
+        Chunk strings
+    """
+    name = f"chunks-{file_hash(file_id, file_path)}-{EXTRACTOR_VERSION}-{strategy}-{chunk_size}-{overlap}.json"
+
+    def produce():
+        pages = iter_pages(file_id, file_path)
+        if strategy == "sentences":
+            return iter_chunks(pages, max_tokens=chunk_size, overlap_tokens=overlap)
+        text = "".join(pages)
+        return iter(chunk_text(text, chunk_size=chunk_size, overlap=overlap) if text.strip() else [])
+
+    return _stream(name, produce)
+
+def get_chunks(file_id, file_path, chunk_size=500, overlap=50, strategy="chars"):
+    """List of chunks of a PDF's text (see iter_file_chunks)"""
+    return list(iter_file_chunks(file_id, file_path, chunk_size, overlap, strategy))
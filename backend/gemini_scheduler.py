@@ -0,0 +1,225 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+
+from google.genai import errors
+
+from text_chunker import estimate_tokens
+
+# Request priorities (lower runs first)
+PRIORITY_TEACHER = 0
+PRIORITY_STUDENT = 1
+PRIORITY_BULK = 2  # summaries and other background work
+
+# Default per-model budgets; override per model with
+# GEMINI_LIMITS="gemini-2.0-flash-exp=10/250000,gemini-2.5-flash-lite=15/250000" (rpm/tpm)
+GEMINI_DEFAULT_RPM = int(os.getenv("GEMINI_DEFAULT_RPM", "10"))
+GEMINI_DEFAULT_TPM = int(os.getenv("GEMINI_DEFAULT_TPM", "250000"))
+GEMINI_LIMITS = os.getenv("GEMINI_LIMITS", "")
+
+# Retries after a 429: exponential backoff with +/-50% jitter, capped
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1.0"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "30"))
+
+# Output tokens assumed per request when charging the TPM budget
+EXPECTED_OUTPUT_TOKENS = int(os.getenv("EXPECTED_OUTPUT_TOKENS", "512"))
+
+def parse_limits(spec):
+    """Parse "model=rpm/tpm,..." into {model: (rpm, tpm)}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, budget = item.partition("=")
+        rpm, _, tpm = budget.partition("/")
+        limits[model.strip()] = (int(rpm), int(tpm) if tpm else GEMINI_DEFAULT_TPM)
+    return limits
+
+def is_rate_limited(e):
+    """True if an exception from the Gemini client is a 429 / quota error"""
+    if isinstance(e, errors.APIError):
+        return e.code == 429
+    return "429" in str(e) or "RESOURCE_EXHAUSTED" in str(e)
+
+def estimate_request_tokens(contents, system_instruction=None):
+    """Rough input + expected output tokens of a generate_content call"""
+    texts = [system_instruction or ""]
+    if isinstance(contents, str):
+        texts.append(contents)
+    else:
+        for content in contents or []:
+            texts.extend(part.text or "" for part in content.parts or [])
+    return sum(estimate_tokens(text) for text in texts) + EXPECTED_OUTPUT_TOKENS
+
+class TokenBucket:
+    """Classic token bucket: capacity tokens, refilled continuously over a minute"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount tokens are available (0 if they are now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+class _ModelState:
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.queue = []  # heap of (priority, seq, tokens, future, enqueued_at)
+        self.wakeup = asyncio.Event()
+        self.dispatcher = None
+        self.paused_until = 0.0
+        self.admitted = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+class GeminiScheduler:
+    """
+    Admission control for Gemini calls
+
+    Each model has an RPM and a TPM token bucket. Callers wait in a
+    per-model priority queue until both buckets can cover the request, so
+    bursts are smoothed out instead of turning into 429s. If Gemini still
+    answers 429, the model is paused for a jittered exponential backoff and
+    the request is re-queued (at its original priority) up to max_retries.
+    """
+    def __init__(self, limits=None, default_rpm=None, default_tpm=None, max_retries=None):
+        self.limits = parse_limits(GEMINI_LIMITS) if limits is None else limits
+        self.default_rpm = default_rpm or GEMINI_DEFAULT_RPM
+        self.default_tpm = default_tpm or GEMINI_DEFAULT_TPM
+        self.max_retries = GEMINI_MAX_RETRIES if max_retries is None else max_retries
+        self._states = {}
+        self._seq = itertools.count()
+        self._loop = None
+
+    def _state(self, model):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Queues and events belong to one event loop; start fresh on a new one
+            self._states = {}
+            self._loop = loop
+        state = self._states.get(model)
+        if state is None:
+            rpm, tpm = self.limits.get(model, (self.default_rpm, self.default_tpm))
+            state = self._states[model] = _ModelState(rpm, tpm)
+        return state
+
+    async def acquire(self, model, tokens=0, priority=PRIORITY_STUDENT):
+        """Wait until the model's budgets admit one request of this many tokens"""
+        state = self._state(model)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(state.queue, (priority, next(self._seq), tokens, future, time.monotonic()))
+        state.wakeup.set()
+        if state.dispatcher is None or state.dispatcher.done():
+            state.dispatcher = asyncio.create_task(self._dispatch(state))
+        await future
+
+    async def _dispatch(self, state):
+        while state.queue:
+            priority, _, tokens, future, enqueued_at = state.queue[0]
+            if future.done():  # caller gave up (cancelled)
+                heapq.heappop(state.queue)
+                continue
+
+            wait = max(
+                state.requests.wait_time(1),
+                state.tokens.wait_time(tokens),
+                state.paused_until - time.monotonic()
+            )
+            if wait > 0:
+                # Sleep until budget frees up, or until a new (maybe higher priority) request arrives
+                state.wakeup.clear()
+                try:
+                    await asyncio.wait_for(state.wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(state.queue)
+            state.requests.take(1)
+            state.tokens.take(tokens)
+            waited = time.monotonic() - enqueued_at
+            state.admitted += 1
+            state.total_wait += waited
+            state.max_wait = max(state.max_wait, waited)
+            future.set_result(None)
+
+    async def run(self, model, call, tokens=0, priority=PRIORITY_STUDENT, max_retries=None):
+        """
+        Run call() (an async Gemini request) within the model's budgets
+
+        Args:
+            model: Model name the call uses
+            call: Zero-argument coroutine function making the request
+            tokens: Estimated tokens of the request (see estimate_request_tokens)
+            priority: PRIORITY_TEACHER, PRIORITY_STUDENT or PRIORITY_BULK
+            max_retries: Override the retry limit (e.g. lower when another model can take over)
+
+        Returns:
+            Whatever call() returns; the last error is raised once retries run out
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            await self.acquire(model, tokens, priority)
+            try:
+                return await call()
+            except Exception as e:
+                if not is_rate_limited(e) or attempt >= max_retries:
+                    raise
+                state = self._state(model)
+                state.rate_limited += 1
+                state.retries += 1
+                delay = min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+                # Gemini is over quota for this model: hold back every queued request, not just this one
+                state.paused_until = max(state.paused_until, time.monotonic() + delay)
+                attempt += 1
+                print(f"⏳ {model} rate limited; retry {attempt}/{max_retries} in {delay:.1f}s")
+
+    def pressure(self, model):
+        """(queued requests, seconds of 429 backoff left) for a model"""
+        state = self._states.get(model)
+        if state is None:
+            return 0, 0.0
+        queue_depth = sum(1 for entry in state.queue if not entry[3].done())
+        return queue_depth, max(0.0, state.paused_until - time.monotonic())
+
+    def stats(self):
+        """Queue depth, wait times and 429 counts per model"""
+        models = {}
+        for model, state in self._states.items():
+            models[model] = {
+                "queue_depth": sum(1 for entry in state.queue if not entry[3].done()),
+                "admitted": state.admitted,
+                "avg_wait_ms": round(1000 * state.total_wait / state.admitted, 1) if state.admitted else None,
+                "max_wait_ms": round(1000 * state.max_wait, 1),
+                "rate_limited": state.rate_limited,
+                "retries": state.retries,
+                "rpm_limit": state.requests.capacity,
+                "tpm_limit": state.tokens.capacity,
+                "paused_for_s": round(max(0.0, state.paused_until - time.monotonic()), 1)
+            }
+        return {"models": models}
+
+# Shared by every Gemini call in this process
+scheduler = GeminiScheduler()
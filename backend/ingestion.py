@@ -0,0 +1,325 @@
+import hashlib
+import os
+from collections import Counter
+from itertools import islice
+
+from bm25_index import bm25_indexes
+from chroma_setup import add_to_chroma
+from course_versions import bump_version
+from extraction_cache import iter_file_chunks
+from database import SessionLocal, Course, CourseFile, IngestionJob, StoredFile
+from jobs import JobCancelled, raise_if_cancelled, update_job
+from upload_store import file_path_for, get_indexed_chunks, release_reference
+
+# Course materials are split into sentence-aware chunks with a token budget
+CHUNK_STRATEGY = "sentences"
+CHUNK_TOKENS = 160
+CHUNK_OVERLAP_TOKENS = 24
+CHUNKER_ID = f"{CHUNK_STRATEGY}-{CHUNK_TOKENS}-{CHUNK_OVERLAP_TOKENS}"
+
+# Chunks embedded and written to Chroma per call; bounds peak memory per job
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+
+def _chunk_metadata(course_id, course_name, course_subject, file_id, course_file_id, chunk_id, content_hash):
+    return {
+        "course_id": str(course_id),
+        "course_name": course_name,
+        "subject": course_subject,
+        "file_id": file_id,
+        "course_file_id": course_file_id,
+        "chunk_id": chunk_id,
+        "chunker": CHUNKER_ID,
+        "content_hash": content_hash
+    }
+
+def chunk_hash(text):
+    """Content hash identifying a chunk's text"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class ChunkIds:
+    """
+    Content-addressed chunk ids for one course file: course_<id>_f<course_file_id>_<hash>[_<n>]
+
+    The same text always gets the same id, so re-indexing can tell which
+    chunks are already embedded. Repeats of identical text within the
+    file get an occurrence suffix.
+    """
+    def __init__(self, course_id, course_file_id):
+        self.prefix = f"course_{course_id}_f{course_file_id}"
+        self.seen = Counter()
+
+    def __call__(self, text):
+        content_hash = chunk_hash(text)
+        n = self.seen[content_hash]
+        self.seen[content_hash] += 1
+        chunk_id = f"{self.prefix}_{content_hash[:24]}"
+        return (chunk_id if n == 0 else f"{chunk_id}_{n}"), content_hash
+
+def iter_batches(items, size):
+    """Yield lists of up to size items from any iterable"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _set_course_file(course_file_id, **fields):
+    db = SessionLocal()
+    try:
+        course_file = db.query(CourseFile).filter(CourseFile.id == course_file_id).first()
+        if course_file is not None:
+            for key, value in fields.items():
+                setattr(course_file, key, value)
+            db.commit()
+    finally:
+        db.close()
+
+def _raise_if_removed(job_id, course_file_id):
+    """Stop a job whose course file was deleted (see jobs.cancel_jobs)"""
+    raise_if_cancelled(job_id)
+    db = SessionLocal()
+    try:
+        exists = db.query(CourseFile.id).filter(CourseFile.id == course_file_id).first() is not None
+    finally:
+        db.close()
+    if not exists:
+        raise JobCancelled(f"Course file {course_file_id} was deleted")
+
+def _discard_cancelled(collections, job_id, course_id, file_id, course_file_id):
+    """
+    Clean up after a job stopped by a file delete
+
+    The delete removed the chunks that existed at the time; this removes
+    any written since. A delete that found the job running leaves the
+    file reference to the job, so the PDF isn't unlinked while it is read.
+    """
+    delete_course_file_chunks(collections, course_id, course_file_id)
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if job is not None and job.status == "cancelling":
+            release_reference(db, file_id)
+            db.commit()
+    finally:
+        db.close()
+
+def index_course_file(collections, job_id, course_id, file_id, course_file_id):
+    """
+    Background job: index one of a course's files (see _index_course_file)
+
+    Keeps the CourseFile row's status in sync with the job. The course's
+    materials are marked as changed after every batch and once more at the
+    end (even on failure, since batches written before the error are
+    already searchable). If the file is deleted while
+    the job runs, the job stops before its next batch and removes what it
+    wrote.
+    """
+    try:
+        counts = _index_course_file(collections, job_id, course_id, file_id, course_file_id)
+    except JobCancelled:
+        _discard_cancelled(collections, job_id, course_id, file_id, course_file_id)
+        raise
+    except Exception:
+        _set_course_file(course_file_id, status="failed")
+        raise
+    finally:
+        bump_version(course_id)
+        refresh_keyword_index(collections, course_id)
+    _set_course_file(course_file_id, status="indexed", num_chunks=counts["total"])
+    return counts
+
+def _index_course_file(collections, job_id, course_id, file_id, course_file_id):
+    """
+    Make the indexed chunks of one course file match an uploaded PDF
+
+    Used for both first ingestion and re-indexing. New chunks are diffed
+    against the chunks stored for this course file by content hash: unchanged chunks
+    only get their metadata updated, new or changed chunks are embedded,
+    and chunks no longer present are deleted. Chunks stream
+    page -> chunk -> batch, so the first batches are searchable before the
+    last page is parsed.
+
+    If the same file (by content hash) was already embedded for another
+    course, its chunk vectors are copied instead of re-embedding.
+
+    Args:
+        collections: CourseCollections; chunks go to the course's collection
+        job_id: IngestionJob id used for progress reporting
+        course_id: Course the material belongs to
+        file_id: Uploaded file id (content hash)
+        course_file_id: CourseFile row the chunks belong to
+    """
+    db = SessionLocal()
+    try:
+        course = db.query(Course).filter(Course.id == course_id).first()
+        if course is None:
+            raise Exception(f"Course {course_id} no longer exists")
+        course_name = course.name
+        course_subject = course.subject
+    finally:
+        db.close()
+
+    _raise_if_removed(job_id, course_file_id)
+    collection = collections.for_course(course_id)
+
+    # What is indexed for this course file right now
+    existing = collection.get(where={"course_file_id": course_file_id}, include=["metadatas"])
+    existing_ids = set(existing["ids"])
+    old_file_ids = {m.get("file_id") for m in existing["metadatas"] if m} - {file_id}
+
+    # Vectors from another course that uploaded the same bytes, by content hash
+    reused_vectors = {}
+    reused = get_indexed_chunks(collections, file_id, exclude_course_id=course_id, chunker=CHUNKER_ID)
+    if reused:
+        chunks = reused["documents"]
+        for text, vector in zip(reused["documents"], reused["embeddings"]):
+            reused_vectors[chunk_hash(text)] = vector
+    else:
+        file_path = file_path_for(file_id)
+        if not file_path.exists():
+            raise Exception("Uploaded file not found")
+        chunks = iter_file_chunks(
+            file_id, file_path,
+            chunk_size=CHUNK_TOKENS, overlap=CHUNK_OVERLAP_TOKENS, strategy=CHUNK_STRATEGY
+        )
+
+    make_id = ChunkIds(course_id, course_file_id)
+    new_ids = set()
+    counts = {"embedded": 0, "reused": 0, "unchanged": 0, "deleted": 0}
+    stored = 0
+
+    for batch in iter_batches(chunks, INGEST_BATCH_SIZE):
+        # Don't write chunks for a file deleted mid-ingest
+        _raise_if_removed(job_id, course_file_id)
+        ids, hashes = zip(*(make_id(text) for text in batch))
+        metadatas = [
+            _chunk_metadata(course_id, course_name, course_subject, file_id, course_file_id, stored + i, hashes[i])
+            for i in range(len(batch))
+        ]
+
+        unchanged = [i for i in range(len(batch)) if ids[i] in existing_ids]
+        copied = [i for i in range(len(batch)) if ids[i] not in existing_ids and hashes[i] in reused_vectors]
+        fresh = [i for i in range(len(batch)) if ids[i] not in existing_ids and hashes[i] not in reused_vectors]
+
+        # Same text already embedded: refresh position/file metadata only
+        if unchanged:
+            collection.update(
+                ids=[ids[i] for i in unchanged],
+                metadatas=[metadatas[i] for i in unchanged]
+            )
+        if copied:
+            add_to_chroma(
+                collection, [batch[i] for i in copied], [ids[i] for i in copied],
+                [metadatas[i] for i in copied], upsert=True,
+                embeddings=[reused_vectors[hashes[i]] for i in copied]
+            )
+        if fresh:
+            add_to_chroma(
+                collection, [batch[i] for i in fresh], [ids[i] for i in fresh],
+                [metadatas[i] for i in fresh], upsert=True
+            )
+
+        new_ids.update(ids)
+        counts["unchanged"] += len(unchanged)
+        counts["reused"] += len(copied)
+        counts["embedded"] += len(fresh)
+        stored += len(batch)
+        # The batch is searchable now; retrieval and answer caches must not keep serving the old materials
+        bump_version(course_id)
+        update_job(job_id, progress=stored)
+
+    if stored == 0:
+        raise Exception("No text found in PDF")
+    _raise_if_removed(job_id, course_file_id)
+
+    # Remove chunks that are no longer part of the material
+    stale = list(existing_ids - new_ids)
+    for batch in iter_batches(stale, INGEST_BATCH_SIZE):
+        collection.delete(ids=batch)
+    counts["deleted"] = len(stale)
+
+    # The course file no longer uses the bytes it was indexed from before
+    if old_file_ids:
+        db = SessionLocal()
+        try:
+            for old_file_id in old_file_ids:
+                if old_file_id:
+                    release_reference(db, old_file_id)
+            db.commit()
+        finally:
+            db.close()
+
+    update_job(job_id, total=stored)
+    counts["total"] = stored
+    print(
+        f"📚 Indexed file {file_id} for course {course_id}: {counts['embedded']} embedded, "
+        f"{counts['reused']} reused, {counts['unchanged']} unchanged, {counts['deleted']} deleted"
+    )
+    return counts
+
+def refresh_keyword_index(collections, course_id):
+    """
+    Rebuild a course's BM25 index after its chunks changed
+
+    Call after bump_version. If the rebuild fails, the next search notices
+    the stale version and rebuilds it instead.
+    """
+    try:
+        bm25_indexes.rebuild(collections.for_course(course_id), course_id)
+    except Exception as e:
+        print(f"⚠️ Keyword index rebuild failed for course {course_id}: {type(e).__name__}: {e}")
+
+def delete_course_file_chunks(collections, course_id, course_file_id):
+    """Remove every chunk of one course file from Chroma"""
+    collection = collections.for_course(course_id, create=False)
+    if collection is not None:
+        collection.delete(where={"course_file_id": course_file_id})
+
+def backfill_course_files(collections):
+    """
+    Create CourseFile rows for courses indexed before files were tracked
+
+    Chunks of those courses are grouped by their file_id metadata and
+    tagged with the new course_file_id so per-file re-indexing and deletes
+    work on them. Courses that already have files are skipped.
+
+    Returns:
+        Number of CourseFile rows created
+    """
+    db = SessionLocal()
+    created = 0
+    try:
+        courses = db.query(Course).filter(~Course.files.any()).all()
+        for course in courses:
+            collection = collections.for_course(course.id, create=False)
+            if collection is None:
+                continue
+            existing = collection.get(include=["metadatas"])
+            by_file = {}
+            for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+                by_file.setdefault(metadata.get("file_id"), []).append((chunk_id, metadata))
+
+            for file_id, chunks in by_file.items():
+                if not file_id:
+                    continue
+                stored = db.query(StoredFile).filter(StoredFile.id == file_id).first()
+                course_file = CourseFile(
+                    course_id=course.id,
+                    file_id=file_id,
+                    filename=stored.filename if stored else None,
+                    status="indexed",
+                    num_chunks=len(chunks)
+                )
+                db.add(course_file)
+                db.flush()
+                for batch in iter_batches(chunks, INGEST_BATCH_SIZE):
+                    collection.update(
+                        ids=[chunk_id for chunk_id, _ in batch],
+                        metadatas=[{**metadata, "course_file_id": course_file.id} for _, metadata in batch]
+                    )
+                created += 1
+        db.commit()
+    finally:
+        db.close()
+    return created
@@ -0,0 +1,192 @@
+import os
+import uuid
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from database import SessionLocal, IngestionJob
+
+# Number of background workers processing ingestion jobs.
+# Ingestion throughput scales with this, not with uvicorn's request concurrency.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+# Job kind -> handler(job_id, course_id, file_id, course_file_id)
+_handlers = {}
+
+class JobCancelled(Exception):
+    """Raised by a handler that stopped because its job was cancelled"""
+
+def register_handler(kind, handler):
+    """
+    Register the function that runs jobs of a given kind
+
+    Args:
+        kind: Job kind stored on the IngestionJob row
+        handler: Callable taking (job_id, course_id, file_id, course_file_id)
+    """
+    _handlers[kind] = handler
+
+def create_job(db, kind, file_id, course_id=None, course_file_id=None):
+    """Create a queued job row (caller commits and then calls submit_job)"""
+    job = IngestionJob(
+        id=str(uuid.uuid4()),
+        kind=kind,
+        course_id=course_id,
+        file_id=file_id,
+        course_file_id=course_file_id,
+        status="queued"
+    )
+    db.add(job)
+    return job
+
+def submit_job(job_id):
+    """Hand a committed job over to the worker pool"""
+    _executor.submit(_run_job, job_id)
+
+def update_job(job_id, **fields):
+    """Update job fields from a worker thread (uses its own session)"""
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if job is None:
+            return
+        for key, value in fields.items():
+            setattr(job, key, value)
+        job.updated_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+def cancel_jobs(db, course_file_id):
+    """
+    Cancel the unfinished jobs of a course file (caller commits)
+
+    Queued jobs never start. Running jobs are marked "cancelling" and stop
+    at their next raise_if_cancelled check, where the handler cleans up
+    what it already wrote.
+
+    Returns:
+        Number of running jobs that will clean up after themselves
+    """
+    pending = db.query(IngestionJob).filter(
+        IngestionJob.course_file_id == course_file_id,
+        IngestionJob.status.in_(["queued", "running", "cancelling"])
+    ).all()
+    running = 0
+    for job in pending:
+        if job.status == "queued":
+            job.status = "cancelled"
+        else:
+            job.status = "cancelling"
+            running += 1
+        job.updated_at = datetime.utcnow()
+    return running
+
+def raise_if_cancelled(job_id):
+    """Raise JobCancelled if the job has been cancelled (call between units of work)"""
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if job is None or job.status in ("cancelling", "cancelled"):
+            raise JobCancelled(f"Job {job_id} was cancelled")
+    finally:
+        db.close()
+
+def _complete_job(job_id):
+    """Mark a job completed unless it was cancelled meanwhile (False then)"""
+    db = SessionLocal()
+    try:
+        updated = db.query(IngestionJob).filter(
+            IngestionJob.id == job_id,
+            IngestionJob.status == "running"
+        ).update({IngestionJob.status: "completed", IngestionJob.updated_at: datetime.utcnow()})
+        db.commit()
+        return updated > 0
+    finally:
+        db.close()
+
+def _run_job(job_id):
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if job is None or job.status not in ("queued", "running", "cancelling"):
+            return
+        kind, course_id, file_id, course_file_id = job.kind, job.course_id, job.file_id, job.course_file_id
+        # A job cancelled mid-run still runs its handler, which only cleans up
+        if job.status != "cancelling":
+            job.status = "running"
+        job.updated_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+    handler = _handlers.get(kind)
+    if handler is None:
+        update_job(job_id, status="failed", error=f"No handler registered for job kind '{kind}'")
+        return
+
+    try:
+        handler(job_id, course_id, file_id, course_file_id)
+        if not _complete_job(job_id):
+            # Cancelled after the handler's last check: run it again to clean up
+            submit_job(job_id)
+            return
+        print(f"✅ Job {job_id} ({kind}) completed")
+    except JobCancelled:
+        update_job(job_id, status="cancelled")
+        print(f"🛑 Job {job_id} ({kind}) cancelled")
+    except Exception as e:
+        print(f"❌ Job {job_id} ({kind}) failed:")
+        print(traceback.format_exc())
+        update_job(job_id, status="failed", error=str(e))
+
+def resume_pending_jobs():
+    """
+    Re-queue jobs left unfinished by a previous server process
+
+    Jobs that were "running" when the server stopped are restarted from scratch;
+    handlers must therefore be safe to re-run. Jobs cancelled while running
+    are resubmitted too, so their handler can finish cleaning up.
+    """
+    db = SessionLocal()
+    try:
+        pending = db.query(IngestionJob).filter(
+            IngestionJob.status.in_(["queued", "running", "cancelling"])
+        ).order_by(IngestionJob.created_at).all()
+        job_ids = [job.id for job in pending]
+        for job in pending:
+            if job.status != "cancelling":
+                job.status = "queued"
+            job.progress = 0
+        db.commit()
+    finally:
+        db.close()
+
+    for job_id in job_ids:
+        submit_job(job_id)
+    return len(job_ids)
+
+def job_to_dict(job):
+    """Serialize a job for the status endpoint"""
+    percent = None
+    if job.total:
+        percent = round(100 * job.progress / job.total, 1)
+    elif job.status == "completed":
+        percent = 100.0
+
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "course_id": job.course_id,
+        "file_id": job.file_id,
+        "course_file_id": job.course_file_id,
+        "status": job.status,
+        "progress": job.progress,
+        "total": job.total,
+        "percent": percent,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None
+    }
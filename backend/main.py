@@ -1,16 +1,24 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from pathlib import Path
-import uuid
-import PyPDF2
+from functools import partial
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import List, Optional
 
 # Import our modules
-from chroma_setup import init_chroma, create_collection, add_to_chroma
-from text_chunker import chunk_text
-from database import get_db, User, Course, Enrollment, generate_course_code, init_db
+from chroma_setup import init_chroma, add_to_chroma
+from course_collections import CourseCollections
+from embedding_cache import get_embedding_function
+import extraction_cache
+from database import get_db, User, Course, CourseFile, Enrollment, IngestionJob, generate_course_code, init_db
+from upload_store import UPLOAD_DIR, UploadRejected, file_path_for, save_upload, add_reference, release_reference
+from ingestion import index_course_file, delete_course_file_chunks, backfill_course_files, refresh_keyword_index
+from course_versions import bump_legacy_version, bump_version
+from bm25_index import bm25_indexes
+from reranker import reranker
+from retrieval import MAX_BATCH_QUERIES, InProcessRetrievalClient, cached_search, cached_search_batch, course_material, retrieval_cache
+import chat_api
+import jobs
 from auth import hash_password, verify_password, create_access_token, get_current_user
 
 # Create FastAPI app
@@ -25,13 +33,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create uploads folder
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-
 # Initialize Chroma (runs once when server starts)
 chroma_client = init_chroma()
-chroma_collection = create_collection(chroma_client, "course_materials")
+# Each course's chunks live in their own collection (see course_collections)
+chroma_collections = CourseCollections(chroma_client)
+
+# Background ingestion handlers (run on the jobs worker pool)
+jobs.register_handler("ingest_course_file", partial(index_course_file, chroma_collections))
+jobs.register_handler("reindex_course_file", partial(index_course_file, chroma_collections))
+
+# Serve the chat endpoints from this process too, retrieving straight from
+# the collections above instead of calling /api/query-chroma over HTTP
+chat_api.set_retrieval_client(InProcessRetrievalClient(chroma_collections))
+app.include_router(chat_api.router)
 
 # ============================================
 # PYDANTIC MODELS (Request/Response schemas)
@@ -49,6 +63,15 @@ class LoginRequest(BaseModel):
 class JoinCourseRequest(BaseModel):
     course_code: str
 
+class BatchQueryItem(BaseModel):
+    query: str
+    course_id: Optional[str] = None
+
+class BatchQueryRequest(BaseModel):
+    queries: List[BatchQueryItem]
+    n_results: int = 3
+    course_id: Optional[str] = None  # used for queries that don't set their own
+
 # ============================================
 # STARTUP EVENT
 # ============================================
@@ -57,6 +80,17 @@ class JoinCourseRequest(BaseModel):
 def startup_event():
     init_db()
     print("🚀 Database initialized")
+    moved = chroma_collections.migrate()
+    if moved:
+        print(f"🚚 Moved {moved} chunks into per-course collections")
+    backfilled = backfill_course_files(chroma_collections)
+    if backfilled:
+        print(f"🗂️ Created {backfilled} course file records for existing courses")
+    resumed = jobs.resume_pending_jobs()
+    if resumed:
+        print(f"🔁 Resumed {resumed} unfinished ingestion jobs")
+    # Cross-encoder (if configured) loads in the background; reranking is MMR only until then
+    reranker.load()
 
 # ============================================
 # BASIC ROUTES
@@ -154,55 +188,52 @@ def get_me(current_user: User = Depends(get_current_user)):
 # ============================================
 
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
-    """Upload a PDF file"""
+async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """Upload a PDF file (stored by content hash, so re-uploads are deduplicated)"""
     try:
         # Check if it's a PDF
         if not file.filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Only PDF files allowed")
         
-        # Generate unique ID
-        file_id = str(uuid.uuid4())
-        file_path = UPLOAD_DIR / f"{file_id}.pdf"
-        
-        # Save file
-        contents = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(contents)
+        # Stream file to disk under its content hash
+        try:
+            stored, is_new = await save_upload(db, file)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        db.commit()
         
         return {
             "success": True,
-            "file_id": file_id,
+            "file_id": stored.id,
             "filename": file.filename,
-            "message": "Upload successful"
+            "duplicate": not is_new,
+            "message": "Upload successful" if is_new else "File already uploaded"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/extract/{file_id}")
 def extract_pdf_text(file_id: str):
     """Extract text from uploaded PDF"""
-    file_path = UPLOAD_DIR / f"{file_id}.pdf"
+    file_path = file_path_for(file_id)
     
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found")
     
     try:
-        with open(file_path, 'rb') as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            
-            # Extract text from all pages
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-            
-            return {
-                "success": True,
-                "file_id": file_id,
-                "num_pages": len(pdf_reader.pages),
-                "text_length": len(text),
-                "preview": text[:500]  # First 500 characters
-            }
+        # Extract text from all pages (cached per file content)
+        pages = extraction_cache.get_pages(file_id, file_path)
+        text = "".join(pages)
+        
+        return {
+            "success": True,
+            "file_id": file_id,
+            "num_pages": len(pages),
+            "text_length": len(text),
+            "preview": text[:500]  # First 500 characters
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -211,7 +242,7 @@ def list_files():
     """List all uploaded files"""
     files = []
     for file_path in UPLOAD_DIR.iterdir():
-        if file_path.is_file():
+        if file_path.is_file() and file_path.suffix == ".pdf":
             files.append({
                 "file_id": file_path.stem,  # filename without extension
                 "size": file_path.stat().st_size
@@ -230,26 +261,16 @@ def store_in_chroma(file_id: str, course_name: str = "Untitled Course"):
     """
     try:
         # Find the uploaded file
-        file_path = UPLOAD_DIR / f"{file_id}.pdf"
+        file_path = file_path_for(file_id)
         
         if not file_path.exists():
             raise HTTPException(status_code=404, detail="File not found")
         
-        # Extract text from PDF
-        with open(file_path, 'rb') as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        
-        if not text.strip():
-            raise HTTPException(status_code=400, detail="No text found in PDF")
-        
-        # Chunk the text
-        chunks = chunk_text(text, chunk_size=500, overlap=50)
+        # Extract and chunk the text (cached per file content and chunker settings)
+        chunks = extraction_cache.get_chunks(file_id, file_path, chunk_size=500, overlap=50)
         
         if len(chunks) == 0:
-            raise HTTPException(status_code=400, detail="No chunks created")
+            raise HTTPException(status_code=400, detail="No text found in PDF")
         
         # Prepare for Chroma
         documents = chunks
@@ -264,7 +285,8 @@ def store_in_chroma(file_id: str, course_name: str = "Untitled Course"):
         ]
         
         # Store in Chroma
-        add_to_chroma(chroma_collection, documents, ids, metadatas)
+        add_to_chroma(chroma_collections.legacy, documents, ids, metadatas)
+        bump_legacy_version()
         
         return {
             "success": True,
@@ -280,7 +302,7 @@ def store_in_chroma(file_id: str, course_name: str = "Untitled Course"):
         raise HTTPException(status_code=500, detail=f"Storage failed: {str(e)}")
 
 @app.get("/api/query-chroma")
-def query_chroma_endpoint(query: str, n_results: int = 3, course_id: Optional[str] = None):
+def query_chroma_endpoint(query: str, n_results: int = 3, course_id: Optional[str] = None, keep_adjacent: bool = False):
     """
     Query Chroma for relevant course content
     
@@ -288,68 +310,121 @@ def query_chroma_endpoint(query: str, n_results: int = 3, course_id: Optional[st
         query: Student's question
         n_results: Number of results to return
         course_id: Optional course ID to filter by specific course
+        keep_adjacent: Keep neighbouring chunks of a file (callers that merge them)
     """
     try:
         if not query.strip():
             raise HTTPException(status_code=400, detail="Query cannot be empty")
         
-        # Build query parameters
-        query_params = {
-            "query_texts": [query],
-            "n_results": n_results
-        }
-        
-        # Add course_id filter if provided
-        if course_id:
-            query_params["where"] = {"course_id": str(course_id)}
-            print(f"🔍 Filtering by course_id: {course_id}")  # DEBUG
-        
-        # Query Chroma
-        results = chroma_collection.query(**query_params)
-        
-        # Format results
-        formatted_results = []
-        if results["documents"] and results["documents"][0]:
-            for i, doc in enumerate(results["documents"][0]):
-                formatted_results.append({
-                    "rank": i + 1,
-                    "content": doc,
-                    "metadata": results["metadatas"][0][i] if results["metadatas"] else None,
-                    "distance": results["distances"][0][i] if results["distances"] else None
-                })
-        
-        print(f"📦 Returned {len(formatted_results)} results for course {course_id if course_id else 'ALL'}")  # DEBUG
-        
-        return {
-            "success": True,
-            "query": query,
-            "num_results": len(formatted_results),
-            "results": formatted_results,
-            "filtered_by_course": course_id is not None
-        }
+        return cached_search(chroma_collections, query, n_results, course_id, keep_adjacent)
     
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
 
+@app.get("/api/course-material")
+def course_material_endpoint(course_id: str, max_tokens: int = 8000):
+    """
+    The start of a course's indexed text, in file order (see retrieval.course_material)
+
+    Args:
+        course_id: Course to read
+        max_tokens: Most tokens of text to return
+    """
+    try:
+        return course_material(chroma_collections, course_id, max_tokens)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reading course material failed: {str(e)}")
+
+@app.post("/api/query-chroma/batch")
+def query_chroma_batch_endpoint(request: BatchQueryRequest):
+    """
+    Query Chroma for many questions in one call
+
+    Queries are embedded together and searched with one Chroma query per
+    course. Each result has the same shape as /api/query-chroma.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries given")
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    if any(not item.query.strip() for item in request.queries):
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+
+    try:
+        queries = [(item.query, item.course_id or request.course_id) for item in request.queries]
+        results = cached_search_batch(chroma_collections, queries, request.n_results)
+        return {
+            "success": True,
+            "num_queries": len(results),
+            "results": results
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+
 @app.get("/api/chroma-stats")
 def chroma_stats():
     """Check how many chunks are stored in Chroma"""
     try:
-        count = chroma_collection.count()
+        count = chroma_collections.count()
         return {
             "success": True,
             "total_chunks": count,
+            "embedding_cache": get_embedding_function().stats(),
+            "keyword_index": bm25_indexes.stats(),
+            "reranker": reranker.stats(),
             "message": f"Database contains {count} chunks"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/cache-stats")
+def cache_stats():
+    """Hit rates of this process's retrieval, answer, context and embedding caches"""
+    return {
+        "success": True,
+        "retrieval_cache": retrieval_cache.stats(),
+        "answer_cache": chat_api.answer_cache.stats(),
+        "context_cache": chat_api.context_cache.stats(),
+        "embedding_cache": get_embedding_function().stats()
+    }
+
 # ============================================
 # COURSE ROUTES (New authenticated endpoints)
 # ============================================
 
+def get_own_course(db, course_id, current_user):
+    """Load a course the current user teaches (404/403 otherwise)"""
+    course = db.query(Course).filter(Course.id == course_id).first()
+    
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    
+    if course.teacher_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not your course")
+    
+    return course
+
+def queue_course_file(db, course_id, stored, filename):
+    """Attach a stored upload to a course and queue its ingestion (caller commits, then submits)"""
+    course_file = CourseFile(course_id=course_id, file_id=stored.id, filename=filename, status="queued")
+    db.add(course_file)
+    db.flush()
+    add_reference(db, stored.id)
+    job = jobs.create_job(db, "ingest_course_file", stored.id, course_id=course_id, course_file_id=course_file.id)
+    return course_file, job
+
+def course_file_to_dict(course_file):
+    return {
+        "id": course_file.id,
+        "file_id": course_file.file_id,
+        "filename": course_file.filename,
+        "status": course_file.status,
+        "num_chunks": course_file.num_chunks,
+        "created_at": course_file.created_at.isoformat() if course_file.created_at else None
+    }
+
 @app.post("/api/courses")
 async def create_course(
     name: str,
@@ -359,7 +434,12 @@ async def create_course(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Create a new course with uploaded materials"""
+    """
+    Create a new course with uploaded materials
+    
+    The PDF is saved and queued for background ingestion; poll
+    GET /api/jobs/{job_id} for extraction/embedding progress.
+    """
     try:
         # Only teachers can create courses
         if current_user.role != "teacher":
@@ -374,6 +454,15 @@ async def create_course(
         if not file.filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Only PDF files allowed")
         
+        # Stream the file to disk before creating anything, so oversized
+        # or invalid uploads are rejected without leaving a course behind
+        try:
+            stored, _ = await save_upload(db, file)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
+        
         # Generate unique course code
         course_code = generate_course_code()
         
@@ -386,55 +475,14 @@ async def create_course(
             course_code=course_code
         )
         db.add(new_course)
+        db.flush()
+        
+        # Hand extraction/chunking/embedding to the job queue
+        course_file, job = queue_course_file(db, new_course.id, stored, file.filename)
         db.commit()
         db.refresh(new_course)
         
-        # Upload and process file
-        try:
-            # Save file
-            file_id = str(uuid.uuid4())
-            file_path = UPLOAD_DIR / f"{file_id}.pdf"
-            contents = await file.read()
-            with open(file_path, "wb") as f:
-                f.write(contents)
-            
-            # Extract text and store in Chroma
-            with open(file_path, 'rb') as f:
-                pdf_reader = PyPDF2.PdfReader(f)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text()
-            
-            if not text.strip():
-                raise Exception("No text found in PDF")
-            
-            # Chunk the text
-            chunks = chunk_text(text, chunk_size=500, overlap=50)
-            
-            if len(chunks) == 0:
-                raise Exception("No chunks created from PDF")
-            
-            # Store in Chroma with course metadata
-            documents = chunks
-            ids = [f"course_{new_course.id}_chunk_{i}" for i in range(len(chunks))]
-            metadatas = [
-                {
-                    "course_id": str(new_course.id),
-                    "course_name": new_course.name,
-                    "subject": new_course.subject,
-                    "file_id": file_id,
-                    "chunk_id": i
-                }
-                for i in range(len(chunks))
-            ]
-            
-            add_to_chroma(chroma_collection, documents, ids, metadatas)
-            
-        except Exception as e:
-            # If file processing fails, delete the course
-            db.delete(new_course)
-            db.commit()
-            raise HTTPException(status_code=500, detail=f"File processing failed: {str(e)}")
+        jobs.submit_job(job.id)
         
         return {
             "success": True,
@@ -444,6 +492,11 @@ async def create_course(
                 "subject": new_course.subject,
                 "course_code": new_course.course_code,
                 "guardrail_level": new_course.guardrail_level
+            },
+            "file": course_file_to_dict(course_file),
+            "job": {
+                "id": job.id,
+                "status": job.status
             }
         }
     
@@ -524,7 +577,8 @@ def get_course_details(
         "course_code": course.course_code if current_user.role == "teacher" else None,
         "guardrail_level": course.guardrail_level,
         "created_at": course.created_at.isoformat(),
-        "enrolled_students": enrolled_students if current_user.role == "teacher" else None
+        "enrolled_students": enrolled_students if current_user.role == "teacher" else None,
+        "files": [course_file_to_dict(f) for f in course.files] if current_user.role == "teacher" else None
     }
 
 @app.post("/api/courses/join")
@@ -566,13 +620,226 @@ def join_course(
         }
     }
 
+@app.get("/api/courses/{course_id}/files")
+def list_course_files(
+    course_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """List a course's material files and their ingestion status"""
+    course = get_own_course(db, course_id, current_user)
+    return {"files": [course_file_to_dict(f) for f in course.files]}
+
+@app.post("/api/courses/{course_id}/files")
+async def add_course_files(
+    course_id: int,
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Add one or more PDFs to an existing course
+    
+    Each file is ingested by its own background job, so files are
+    processed in parallel and existing materials are left untouched.
+    """
+    get_own_course(db, course_id, current_user)
+    
+    for file in files:
+        if not file.filename.endswith('.pdf'):
+            raise HTTPException(status_code=400, detail=f"Only PDF files allowed: {file.filename}")
+    
+    added = []
+    skipped = []
+    queued_jobs = []
+    for file in files:
+        try:
+            stored, _ = await save_upload(db, file)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=f"{file.filename}: {str(e)}")
+        
+        # Same bytes already in this course
+        existing = db.query(CourseFile).filter(
+            CourseFile.course_id == course_id,
+            CourseFile.file_id == stored.id
+        ).first()
+        if existing:
+            skipped.append(course_file_to_dict(existing))
+            continue
+        
+        course_file, job = queue_course_file(db, course_id, stored, file.filename)
+        added.append((course_file, job))
+        queued_jobs.append(job.id)
+    
+    db.commit()
+    for job_id in queued_jobs:
+        jobs.submit_job(job_id)
+    
+    return {
+        "success": True,
+        "files": [
+            {**course_file_to_dict(course_file), "job_id": job.id}
+            for course_file, job in added
+        ],
+        "already_present": skipped
+    }
+
+@app.put("/api/courses/{course_id}/files/{course_file_id}")
+async def replace_course_file(
+    course_id: int,
+    course_file_id: int,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Replace one of a course's files with an updated PDF
+    
+    Re-indexing is incremental: only chunks whose text changed are
+    embedded, and chunks no longer in the file are deleted.
+    """
+    get_own_course(db, course_id, current_user)
+    
+    course_file = db.query(CourseFile).filter(
+        CourseFile.id == course_file_id,
+        CourseFile.course_id == course_id
+    ).first()
+    if not course_file:
+        raise HTTPException(status_code=404, detail="File not found in this course")
+    
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files allowed")
+    
+    try:
+        stored, _ = await save_upload(db, file)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
+    
+    if stored.id != course_file.file_id:
+        duplicate = db.query(CourseFile).filter(
+            CourseFile.course_id == course_id,
+            CourseFile.file_id == stored.id
+        ).first()
+        if duplicate:
+            raise HTTPException(status_code=400, detail="This PDF is already another file of the course")
+        # The old bytes' reference is released once re-indexing completes
+        add_reference(db, stored.id)
+        course_file.file_id = stored.id
+    
+    course_file.filename = file.filename
+    course_file.status = "queued"
+    job = jobs.create_job(db, "reindex_course_file", stored.id, course_id=course_id, course_file_id=course_file.id)
+    db.commit()
+    jobs.submit_job(job.id)
+    
+    return {
+        "success": True,
+        "file": course_file_to_dict(course_file),
+        "job": {
+            "id": job.id,
+            "status": job.status
+        }
+    }
+
+@app.delete("/api/courses/{course_id}/files/{course_file_id}")
+def delete_course_file(
+    course_id: int,
+    course_file_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Remove a file and all of its chunks from a course"""
+    get_own_course(db, course_id, current_user)
+    
+    course_file = db.query(CourseFile).filter(
+        CourseFile.id == course_file_id,
+        CourseFile.course_id == course_id
+    ).first()
+    if not course_file:
+        raise HTTPException(status_code=404, detail="File not found in this course")
+    
+    try:
+        # Stop ingestion of this file first; a running job cleans up its own writes
+        running_jobs = jobs.cancel_jobs(db, course_file.id)
+        delete_course_file_chunks(chroma_collections, course_id, course_file.id)
+        bump_version(course_id)
+        refresh_keyword_index(chroma_collections, course_id)
+        if not running_jobs:
+            # Otherwise the running job releases it once it has stopped reading the PDF
+            release_reference(db, course_file.file_id)
+        db.delete(course_file)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"File deletion failed: {str(e)}")
+    
+    return {
+        "success": True,
+        "message": "File removed from course"
+    }
+
+# ============================================
+# JOB ROUTES
+# ============================================
+
+@app.get("/api/jobs/{job_id}")
+def get_job_status(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get status and progress of a background ingestion job"""
+    job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    # Only the course's teacher can see its jobs
+    if job.course_id is not None:
+        course = db.query(Course).filter(Course.id == job.course_id).first()
+        if not course or course.teacher_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Not your job")
+    
+    return jobs.job_to_dict(job)
+
+@app.get("/api/courses/{course_id}/jobs")
+def get_course_jobs(
+    course_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """List ingestion jobs for a course (most recent first)"""
+    course = db.query(Course).filter(Course.id == course_id).first()
+    
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    
+    if course.teacher_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not your course")
+    
+    course_jobs = db.query(IngestionJob).filter(
+        IngestionJob.course_id == course_id
+    ).order_by(IngestionJob.created_at.desc()).all()
+    
+    return {"jobs": [jobs.job_to_dict(job) for job in course_jobs]}
+
 @app.get("/api/debug/chroma")
 def debug_chroma():
     """Debug: See all Chroma metadata"""
     try:
-        all_data = chroma_collection.get()
+        counts = {}
+        all_data = {"ids": [], "metadatas": []}
+        for course_id, collection in chroma_collections.partitions():
+            if collection is None:
+                continue
+            counts[collection.name] = collection.count()
+            if not all_data["ids"]:
+                all_data = collection.get(limit=3)
         return {
-            "total_chunks": len(all_data["ids"]),
+            "total_chunks": sum(counts.values()),
+            "collections": counts,
             "sample_ids": all_data["ids"][:3],
             "sample_metadata": all_data["metadatas"][:3] if all_data["metadatas"] else []
         }
@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+
+from text_chunker import estimate_tokens
+
+# Model tiers, most capable first. Chat requests start at a tier picked from
+# the question and fall back to cheaper/faster tiers under load.
+MODEL_TIERS = {
+    "quality": os.getenv("MODEL_TIER_QUALITY", "gemini-2.5-flash"),
+    "standard": os.getenv("MODEL_TIER_STANDARD", os.getenv("CHAT_MODEL", "gemini-2.0-flash-exp")),
+    "lite": os.getenv("MODEL_TIER_LITE", "gemini-2.5-flash-lite"),
+}
+TIER_ORDER = ["quality", "standard", "lite"]
+
+# Subjects whose questions usually need multi-step reasoning
+REASONING_SUBJECTS = {"math", "physics", "computer_science"}
+# Question length (estimated tokens) thresholds for picking a tier
+LONG_QUESTION_TOKENS = int(os.getenv("LONG_QUESTION_TOKENS", "120"))
+REASONING_QUESTION_TOKENS = int(os.getenv("REASONING_QUESTION_TOKENS", "40"))
+SHORT_QUESTION_TOKENS = int(os.getenv("SHORT_QUESTION_TOKENS", "8"))
+
+# Step down a tier when a model is this slow (p90, ms) or this backed up (queued requests)
+LATENCY_BUDGET_MS = int(os.getenv("LATENCY_BUDGET_MS", "8000"))
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", "20"))
+# Requests per day per model, e.g. "gemini-2.0-flash-exp=50,gemini-2.5-flash-lite=1500" (unset = unlimited)
+MODEL_DAILY_LIMITS = os.getenv("MODEL_DAILY_LIMITS", "gemini-2.0-flash-exp=50,gemini-2.5-flash-lite=1500")
+# A model that exhausted its retries on 429s is skipped for this long
+QUOTA_COOLDOWN = int(os.getenv("QUOTA_COOLDOWN", "60"))
+
+# Latency samples kept per model for percentiles
+LATENCY_WINDOW = 200
+
+def parse_daily_limits(spec):
+    """Parse "model=requests_per_day,..." into {model: limit}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, limit = item.partition("=")
+        limits[model.strip()] = int(limit)
+    return limits
+
+class ModelRouter:
+    """
+    Picks the Gemini model for each chat request
+
+    The starting tier depends on question length and subject. A tier is
+    skipped while its model is out of daily quota, cooling down after
+    rate limits, backed up in the scheduler queue, or slower than the
+    latency budget (p90 of recent calls). The remaining tiers are returned
+    in order so callers can fall back if a call fails.
+    """
+    def __init__(self, tiers=None, daily_limits=None, scheduler=None):
+        self.tiers = tiers or MODEL_TIERS
+        self.daily_limits = parse_daily_limits(MODEL_DAILY_LIMITS) if daily_limits is None else daily_limits
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._latencies = {}  # model -> deque of seconds
+        self._counts = {}  # model -> {"requests", "failures", "fallbacks"}
+        self._day = None
+        self._used_today = {}
+        self._cooldown_until = {}
+
+    def base_tier(self, question, subject="generic"):
+        """Tier a question starts at, before load and quota are considered"""
+        tokens = estimate_tokens(question)
+        reasoning = subject.lower() in REASONING_SUBJECTS
+        if tokens >= LONG_QUESTION_TOKENS or (reasoning and tokens >= REASONING_QUESTION_TOKENS):
+            return "quality"
+        if tokens <= SHORT_QUESTION_TOKENS and not reasoning:
+            return "lite"
+        return "standard"
+
+    def _roll_day(self):
+        today = datetime.now(timezone.utc).date()
+        if today != self._day:
+            self._day = today
+            self._used_today = {}
+
+    def unavailable_reason(self, model):
+        """Why a model should be skipped right now, or None if it is usable"""
+        with self._lock:
+            self._roll_day()
+            limit = self.daily_limits.get(model)
+            if limit is not None and self._used_today.get(model, 0) >= limit:
+                return "daily quota used"
+            if self._cooldown_until.get(model, 0) > time.monotonic():
+                return "rate limited"
+            samples = self._latencies.get(model)
+            if samples and len(samples) >= 10 and np.percentile(samples, 90) * 1000 > LATENCY_BUDGET_MS:
+                return "slow"
+        if self.scheduler is not None:
+            queue_depth, paused_for = self.scheduler.pressure(model)
+            if queue_depth >= MAX_QUEUE_DEPTH:
+                return "queue full"
+            if paused_for > 0:
+                return "backing off"
+        return None
+
+    def route(self, question, subject="generic"):
+        """
+        Models to try for a request, preferred first
+
+        Tiers from the question's base tier down are included; unavailable
+        ones move to the end (they're still a last resort if every tier is
+        struggling).
+        """
+        start = TIER_ORDER.index(self.base_tier(question, subject))
+        models = list(dict.fromkeys(self.tiers[tier] for tier in TIER_ORDER[start:]))
+        available, skipped = [], []
+        for model in models:
+            reason = self.unavailable_reason(model)
+            if reason:
+                print(f"🔀 Skipping {model}: {reason}")  # DEBUG
+                skipped.append(model)
+            else:
+                available.append(model)
+        return available + skipped
+
+    def record(self, model, seconds, ok=True, rate_limited=False, fallback=False):
+        """Record the outcome of one call to a model"""
+        with self._lock:
+            self._roll_day()
+            counts = self._counts.setdefault(model, {"requests": 0, "failures": 0, "fallbacks": 0})
+            counts["requests"] += 1
+            self._used_today[model] = self._used_today.get(model, 0) + 1
+            if fallback:
+                counts["fallbacks"] += 1
+            if ok:
+                self._latencies.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+            else:
+                counts["failures"] += 1
+            if rate_limited:
+                self._cooldown_until[model] = time.monotonic() + QUOTA_COOLDOWN
+
+    def stats(self):
+        """Per-model request counts, quota use and latency percentiles"""
+        with self._lock:
+            self._roll_day()
+            models = {}
+            for model in dict.fromkeys([*self.tiers.values(), *self._counts]):
+                samples = self._latencies.get(model)
+                percentiles = None
+                if samples:
+                    p50, p90, p99 = np.percentile(samples, [50, 90, 99]) * 1000
+                    percentiles = {"p50": round(p50, 1), "p90": round(p90, 1), "p99": round(p99, 1)}
+                models[model] = {
+                    **self._counts.get(model, {"requests": 0, "failures": 0, "fallbacks": 0}),
+                    "used_today": self._used_today.get(model, 0),
+                    "daily_limit": self.daily_limits.get(model),
+                    "latency_ms": percentiles
+                }
+            return {
+                "tiers": self.tiers,
+                "models": models
+            }
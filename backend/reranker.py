@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+# Post-retrieval stage: rerank a larger candidate set down to n_results
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() == "true"
+# Candidates fetched per query for the reranker to choose from
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+# MMR trade-off: 1.0 = relevance only, 0.0 = diversity only
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Chunks of the same file this close (by chunk_id) count as duplicates
+RERANK_ADJACENT_GAP = int(os.getenv("RERANK_ADJACENT_GAP", "1"))
+# Per-query time budget; past it the remaining slots are filled in relevance order
+RERANK_TIME_BUDGET_MS = float(os.getenv("RERANK_TIME_BUDGET_MS", "50"))
+# Optional local cross-encoder (e.g. cross-encoder/ms-marco-MiniLM-L-6-v2); unset = MMR only
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL")
+# Most candidates (best first) the cross-encoder scores per query
+RERANK_CROSS_ENCODER_MAX = int(os.getenv("RERANK_CROSS_ENCODER_MAX", "10"))
+# Weight of the latest call in the running cross-encoder time per candidate
+_PREDICT_MS_SMOOTHING = 0.3
+
+def _position(candidate):
+    metadata = candidate.get("metadata") or {}
+    file_id = metadata.get("file_id")
+    chunk_id = metadata.get("chunk_id")
+    if file_id is None or not isinstance(chunk_id, int):
+        return None
+    return file_id, chunk_id
+
+def dedupe_adjacent(candidates, gap=None):
+    """
+    Drop chunks that neighbour a better-ranked chunk of the same file
+
+    Consecutive chunks overlap, so a neighbour of a chunk already chosen
+    mostly repeats it.
+
+    Args:
+        candidates: Search results, best first
+        gap: Largest chunk_id distance treated as a duplicate
+
+    Returns:
+        (kept, dropped) lists, each in the original order
+    """
+    gap = RERANK_ADJACENT_GAP if gap is None else gap
+    kept, dropped = [], []
+    seen = {}  # file_id -> chunk_ids kept so far
+    for candidate in candidates:
+        position = _position(candidate)
+        if position is not None:
+            file_id, chunk_id = position
+            if any(abs(chunk_id - other) <= gap for other in seen.get(file_id, ())):
+                dropped.append(candidate)
+                continue
+            seen.setdefault(file_id, []).append(chunk_id)
+        kept.append(candidate)
+    return kept, dropped
+
+def adjacent_pairs(candidates):
+    """Boolean matrix marking candidates that are consecutive chunks of the same file"""
+    positions = [_position(candidate) for candidate in candidates]
+    adjacent = np.zeros((len(candidates), len(candidates)), dtype=bool)
+    for i, a in enumerate(positions):
+        for j, b in enumerate(positions):
+            adjacent[i, j] = a is not None and b is not None and a[0] == b[0] and abs(a[1] - b[1]) == 1
+    return adjacent
+
+def mmr(vectors, relevance, n_results, mmr_lambda=None, deadline=None, exempt=None):
+    """
+    Maximal marginal relevance selection
+
+    Args:
+        vectors: Candidate embeddings (rows)
+        relevance: Candidate relevance in [0, 1]
+        n_results: Number of candidates to pick
+        mmr_lambda: Relevance/diversity trade-off
+        deadline: time.perf_counter() value after which selection stops early
+        exempt: Optional boolean matrix of pairs not penalized for similarity
+
+    Returns:
+        (indexes of picked candidates in pick order, whether the deadline cut it short)
+    """
+    mmr_lambda = MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    similarity = vectors @ vectors.T
+    if exempt is not None:
+        similarity[exempt] = 0
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    picked = []
+    remaining = list(range(len(vectors)))
+    max_similarity = np.zeros(len(vectors), dtype=np.float32)
+    while remaining and len(picked) < n_results:
+        if deadline is not None and picked and time.perf_counter() > deadline:
+            # Out of time: fill up by relevance alone
+            remaining.sort(key=lambda i: -relevance[i])
+            picked.extend(remaining[:n_results - len(picked)])
+            return picked, True
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * max_similarity[remaining]
+        best = remaining.pop(int(np.argmax(scores)))
+        picked.append(best)
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return picked, False
+
+class Reranker:
+    """
+    Picks the final results from a larger retrieval candidate set
+
+    Adjacent chunks of the same file are deduplicated, candidates are
+    optionally rescored by a local cross-encoder, and MMR trades relevance
+    against redundancy. Each query gets a time budget; whatever is left
+    when it runs out is filled in relevance order.
+
+    The cross-encoder (sentence_transformers, optional) is loaded in a
+    background thread by load(), so no request waits for it; until it is
+    ready reranking is MMR only. It scores at most RERANK_CROSS_ENCODER_MAX
+    candidates, and is skipped when its measured time per candidate says
+    the call would not fit in what is left of the budget.
+    """
+    def __init__(self, model_name=None, time_budget_ms=None):
+        self.model_name = model_name or CROSS_ENCODER_MODEL
+        self.time_budget_ms = RERANK_TIME_BUDGET_MS if time_budget_ms is None else time_budget_ms
+        self._model = None
+        self._model_failed = False
+        self._loading = False
+        self._lock = threading.Lock()
+        self.predict_ms_per_candidate = None
+        self.counts = Counter()
+        self.total_ms = 0.0
+
+    def load(self):
+        """Start loading the cross-encoder in the background (no-op if unset or already loading)"""
+        if not self.model_name:
+            return
+        with self._lock:
+            if self._model is not None or self._model_failed or self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._load, name="cross-encoder-load", daemon=True).start()
+
+    def _load(self):
+        try:
+            from sentence_transformers import CrossEncoder
+
+            model = CrossEncoder(self.model_name)
+            # Warm-up call, which also gives the first time-per-candidate estimate
+            pairs = [("warm up", "warm up")] * 4
+            started = time.perf_counter()
+            model.predict(pairs)
+            self._record_predict(started, len(pairs))
+            self._model = model
+            print(f"🎯 Loaded cross-encoder {self.model_name} ({self.predict_ms_per_candidate:.1f}ms per candidate)")  # DEBUG
+        except Exception as e:  # ImportError too: sentence_transformers is optional
+            self._model_failed = True
+            print(f"⚠️ Cross-encoder unavailable, using MMR only: {type(e).__name__}: {e}")
+        finally:
+            self._loading = False
+
+    def _cross_encoder(self):
+        if self._model is None:
+            self.load()
+        return self._model
+
+    def _record_predict(self, started, n_candidates):
+        ms = 1000 * (time.perf_counter() - started) / n_candidates
+        previous = self.predict_ms_per_candidate
+        self.predict_ms_per_candidate = ms if previous is None else (
+            _PREDICT_MS_SMOOTHING * ms + (1 - _PREDICT_MS_SMOOTHING) * previous
+        )
+
+    def rerank(self, query, candidates, relevance, n_results, keep_adjacent=False):
+        """
+        Choose n_results of the candidates
+
+        Args:
+            query: The search query
+            candidates: Search results, best first, each with an "embedding"
+            relevance: Retrieval relevance of each candidate (higher is better)
+            n_results: Number of results to return
+            keep_adjacent: Keep neighbouring chunks of a file (for callers that
+                merge them, like context_packer): only exact repeats are dropped
+                and MMR doesn't count a neighbour as redundant
+
+        Returns:
+            The chosen candidates, best first
+        """
+        started = time.perf_counter()
+        deadline = started + self.time_budget_ms / 1000
+        self.counts["requests"] += 1
+        if len(candidates) <= 1:
+            return candidates[:n_results]
+
+        relevance = dict(zip((id(c) for c in candidates), relevance))
+        kept, dropped = dedupe_adjacent(candidates, gap=0 if keep_adjacent else None)
+        self.counts["deduped"] += len(dropped)
+        if len(kept) < n_results:
+            # Not enough distinct chunks: neighbours are better than nothing
+            kept = kept + dropped[:n_results - len(kept)]
+
+        scores = np.array([relevance[id(c)] for c in kept], dtype=np.float32)
+        model = self._cross_encoder()
+        if model is not None:
+            # Only the best candidates are worth the model's time
+            scored = kept[:max(RERANK_CROSS_ENCODER_MAX, n_results)]
+            remaining_ms = 1000 * (deadline - time.perf_counter())
+            if self.predict_ms_per_candidate * len(scored) > remaining_ms:
+                self.counts["cross_encoder_skipped"] += 1
+            else:
+                try:
+                    predict_started = time.perf_counter()
+                    logits = np.asarray(model.predict([(query, c["content"]) for c in scored]), dtype=np.float32)
+                    self._record_predict(predict_started, len(scored))
+                    kept, scores = scored, 1 / (1 + np.exp(-logits))
+                    self.counts["cross_encoder"] += 1
+                except Exception as e:
+                    print(f"⚠️ Cross-encoder failed: {type(e).__name__}: {e}")
+
+        # Scale to [0, 1] so relevance and similarity are comparable in MMR
+        low, high = float(scores.min()), float(scores.max())
+        scores = (scores - low) / (high - low) if high > low else np.ones_like(scores)
+
+        if time.perf_counter() >= deadline:
+            order, over_budget = list(np.argsort(-scores, kind="stable")[:n_results]), True
+        else:
+            exempt = adjacent_pairs(kept) if keep_adjacent else None
+            order, over_budget = mmr([c["embedding"] for c in kept], scores, n_results, deadline=deadline, exempt=exempt)
+        if over_budget:
+            self.counts["over_budget"] += 1
+
+        self.total_ms += 1000 * (time.perf_counter() - started)
+        return [kept[i] for i in order]
+
+    def stats(self):
+        requests = self.counts["requests"]
+        return {
+            "enabled": RERANK_ENABLED,
+            "cross_encoder": self.model_name if self._model is not None else None,
+            "requests": requests,
+            "cross_encoder_used": self.counts["cross_encoder"],
+            "cross_encoder_skipped": self.counts["cross_encoder_skipped"],
+            "cross_encoder_ms_per_candidate": (
+                round(self.predict_ms_per_candidate, 2) if self.predict_ms_per_candidate is not None else None
+            ),
+            "deduped": self.counts["deduped"],
+            "over_budget": self.counts["over_budget"],
+            "avg_ms": round(self.total_ms / requests, 2) if requests else None,
+            "time_budget_ms": self.time_budget_ms
+        }
+
+reranker = Reranker()
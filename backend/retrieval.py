@@ -0,0 +1,553 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import httpx
+
+from bm25_index import bm25_indexes
+from context_packer import pack_context
+from course_versions import get_version
+from embedding_cache import get_embedding_function
+from reranker import RERANK_CANDIDATES, RERANK_ENABLED, reranker
+
+# How the chat service reaches course materials:
+#   "inprocess" - query the Chroma collection directly (chat served by the backend process)
+#   "http"      - call the backend's /api/query-chroma over a pooled connection
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "http")
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "10"))
+
+# Retrieval result cache: entries per process, and an optional SQLite file
+# shared by all workers on this machine (unset = in-memory only)
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2048"))
+RETRIEVAL_CACHE_SHARED_PATH = os.getenv("RETRIEVAL_CACHE_SHARED_PATH")
+
+# Hybrid search: fuse BM25 keyword and vector rankings (reciprocal rank fusion)
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+# Candidates taken from each ranking before fusing
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Most queries accepted by one /api/query-chroma/batch call
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "100"))
+
+# Fewest tokens a chunk is assumed to hold when reading the start of each file
+_MATERIAL_MIN_CHUNK_TOKENS = 64
+
+def fuse_rankings(rankings, k=None):
+    """
+    Reciprocal rank fusion of several best-first lists of ids
+
+    Returns:
+        {id: fused score}; ids ranked well by more lists score higher
+    """
+    k = k or RRF_K
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank + 1)
+    return scores
+
+def search_course_materials_batch(collections, queries, n_results=3, course_id=None, query_embeddings=None,
+                                  keep_adjacent=False):
+    """
+    Query Chroma for relevant course content, for several queries at once
+
+    All queries share one course and go to that course's collection as a
+    single vectorized query. With hybrid search on, each query's vector
+    results are fused with BM25 keyword matches from the course's inverted
+    index, so exact terms (theorem names, identifiers) are found even when
+    their embedding is not close to the question's. With reranking on, the
+    final results are picked from RERANK_CANDIDATES candidates (see
+    reranker), skipping near-duplicate neighbouring chunks.
+
+    Without a course, every collection is searched and the candidates are
+    merged before fusing: vector hits by distance (all collections share
+    one embedding model) and keyword hits by BM25 score (idf is per course,
+    so these are only roughly comparable). The fused ranking and the
+    reranking are then computed once over all courses rather than per
+    course and mixed afterwards.
+
+    Args:
+        collections: CourseCollections
+        queries: List of questions
+        n_results: Number of results to return per query
+        course_id: Optional course ID to search a single course
+        query_embeddings: Optional precomputed vectors of the queries
+        keep_adjacent: Let the reranker keep neighbouring chunks of a file
+            (the chat service merges them into passages)
+
+    Returns:
+        List of result dicts (see search_course_materials), one per query
+    """
+    if course_id:
+        print(f"🔍 Searching course_id: {course_id}")  # DEBUG
+        partitions = [(course_id, collections.for_course(course_id, create=False))]
+    else:
+        if query_embeddings is None:
+            query_embeddings = get_embedding_function()(list(queries))
+        partitions = list(collections.partitions())
+    partitions = [(partition_id, collection) for partition_id, collection in partitions if collection is not None]
+
+    # Results handed to the reranker (or returned directly without it)
+    n_keep = max(n_results, RERANK_CANDIDATES) if RERANK_ENABLED else n_results
+    n_candidates = max(n_keep, HYBRID_CANDIDATES) if HYBRID_SEARCH_ENABLED else n_keep
+
+    chunks, owners = {}, {}
+    vector_hits = [[] for _ in queries]  # (distance, chunk id) per query
+    keyword_scores = [{} for _ in queries]
+    keyword_index_stale = False
+    for partition_id, collection in partitions:
+        found, hits, scores, stale = _partition_candidates(
+            collection, queries, partition_id, n_candidates, query_embeddings
+        )
+        keyword_index_stale = keyword_index_stale or stale
+        chunks.update(found)
+        for q in range(len(queries)):
+            vector_hits[q].extend(hits[q])
+            keyword_scores[q].update(scores[q])
+            # Keyword-only matches are loaded later from the collection they came from
+            owners.update(dict.fromkeys(scores[q], collection))
+
+    batch_results = []
+    for q, query in enumerate(queries):
+        vector_ranking = [chunk_id for _, chunk_id in sorted(vector_hits[q], key=lambda hit: hit[0])][:n_candidates]
+        scores = dict(sorted(keyword_scores[q].items(), key=lambda item: -item[1])[:n_candidates])
+        if scores:
+            fused = fuse_rankings([vector_ranking, list(scores)])
+            ranked = sorted(fused, key=fused.get, reverse=True)[:n_keep]
+        else:
+            fused, ranked = {}, vector_ranking[:n_keep]
+
+        _fetch_missing(chunks, owners, ranked)
+        candidates = [
+            {**chunks[chunk_id], "keyword_score": scores.get(chunk_id), "score": fused.get(chunk_id)}
+            for chunk_id in ranked if chunk_id in chunks
+        ]
+        if RERANK_ENABLED and len(candidates) > n_results:
+            relevance = [
+                c["score"] if c["score"] is not None else 1.0 / (RRF_K + i + 1)
+                for i, c in enumerate(candidates)
+            ]
+            candidates = reranker.rerank(query, candidates, relevance, n_results, keep_adjacent)
+
+        # Format results
+        formatted_results = []
+        for candidate in candidates[:n_results]:
+            formatted_results.append({
+                "rank": len(formatted_results) + 1,
+                "content": candidate["content"],
+                "metadata": candidate["metadata"],
+                "distance": candidate["distance"],
+                "keyword_score": candidate["keyword_score"],
+                "score": candidate["score"]
+            })
+
+        batch_results.append({
+            "success": True,
+            "query": query,
+            "num_results": len(formatted_results),
+            "results": formatted_results,
+            "filtered_by_course": course_id is not None,
+            # Keyword matches came from an index still being rebuilt (see bm25_index)
+            "keyword_index_stale": keyword_index_stale
+        })
+
+    _log_batch(batch_results, course_id)
+    return batch_results
+
+def _log_batch(batch_results, course_id):
+    """One summary line per search call, however many queries it had"""
+    results = [r for batch in batch_results for r in batch["results"]]
+    queries = f"{len(batch_results)} queries" if len(batch_results) != 1 else "1 query"
+    print(
+        f"📦 Returned {len(results)} results for {queries} in course {course_id if course_id else 'ALL'}"
+        f" ({sum(1 for r in results if r['keyword_score'] is not None)} keyword matches)"
+    )  # DEBUG
+
+def _include():
+    return ["documents", "metadatas", "distances"] + (["embeddings"] if RERANK_ENABLED else [])
+
+def _partition_candidates(collection, queries, course_id, n_candidates, query_embeddings=None):
+    """
+    Vector and keyword candidates of one collection
+
+    Returns:
+        (chunks by id, [(distance, chunk id)] per query, {chunk id: BM25 score} per query,
+        whether the keyword index was out of date)
+    """
+    query_params = {"n_results": n_candidates, "include": _include()}
+    if query_embeddings is not None:
+        query_params["query_embeddings"] = query_embeddings
+    else:
+        query_params["query_texts"] = list(queries)
+    results = collection.query(**query_params)
+
+    chunks = {}
+    vector_hits = []
+    for q in range(len(queries)):
+        hits = []
+        if results["documents"] and results["documents"][q]:
+            for i, doc in enumerate(results["documents"][q]):
+                chunk_id = results["ids"][q][i]
+                distance = results["distances"][q][i] if results["distances"] else None
+                hits.append((distance if distance is not None else float("inf"), chunk_id))
+                chunks[chunk_id] = {
+                    "content": doc,
+                    "metadata": results["metadatas"][q][i] if results["metadatas"] else None,
+                    "distance": distance,
+                    "embedding": results["embeddings"][q][i] if RERANK_ENABLED else None
+                }
+        vector_hits.append(hits)
+
+    keyword_scores = [{} for _ in queries]
+    stale = False
+    if HYBRID_SEARCH_ENABLED:
+        try:
+            index, current = bm25_indexes.get(collection, course_id)
+            keyword_scores = [dict(index.search(query, n_candidates)) for query in queries]
+            stale = not current
+        except Exception as e:
+            print(f"⚠️ Keyword search failed, using vector results only: {type(e).__name__}: {e}")
+    return chunks, vector_hits, keyword_scores, stale
+
+def _fetch_missing(chunks, owners, chunk_ids):
+    """Load text and metadata of keyword-only matches from their collections"""
+    by_collection = {}
+    for chunk_id in chunk_ids:
+        if chunk_id not in chunks and chunk_id in owners:
+            by_collection.setdefault(id(owners[chunk_id]), (owners[chunk_id], []))[1].append(chunk_id)
+    for collection, missing in by_collection.values():
+        extra = collection.get(ids=missing, include=[field for field in _include() if field != "distances"])
+        for i, chunk_id in enumerate(extra["ids"]):
+            chunks[chunk_id] = {
+                "content": extra["documents"][i],
+                "metadata": extra["metadatas"][i],
+                "distance": None,
+                "embedding": extra["embeddings"][i] if RERANK_ENABLED else None
+            }
+
+def search_course_materials(collections, query, n_results=3, course_id=None, keep_adjacent=False):
+    """
+    Query Chroma for relevant course content
+
+    Shared by the /api/query-chroma endpoint and the in-process retrieval
+    client so both return exactly the same results.
+
+    Args:
+        collections: CourseCollections
+        query: Student's question
+        n_results: Number of results to return
+        course_id: Optional course ID to filter by specific course
+        keep_adjacent: Keep neighbouring chunks of a file (see search_course_materials_batch)
+
+    Returns:
+        Dict with "query", "num_results", "results" and "filtered_by_course"
+    """
+    return search_course_materials_batch(collections, [query], n_results, course_id, keep_adjacent=keep_adjacent)[0]
+
+def course_material(collections, course_id, max_tokens):
+    """
+    The start of a course's indexed text, in file order, up to max_tokens
+
+    Unlike retrieved context this is the same for every question about the
+    course, so chat uses it as the cacheable part of its prompts (see
+    context_cache). Consecutive chunks are merged without their overlap.
+
+    Args:
+        collections: CourseCollections
+        course_id: Course to read
+        max_tokens: Most tokens of text to return
+
+    Returns:
+        Dict with "course_id", "text", "tokens" and "num_chunks"
+    """
+    collection = collections.for_course(course_id, create=False)
+    chunks = []
+    if collection is not None:
+        # Only the first chunks of each file can fit
+        page = collection.get(
+            where={"chunk_id": {"$lt": max_tokens // _MATERIAL_MIN_CHUNK_TOKENS + 1}},
+            include=["documents", "metadatas"]
+        )
+        chunks = [
+            {"content": document, "metadata": metadata or {}}
+            for document, metadata in zip(page["documents"], page["metadatas"])
+        ]
+    chunks.sort(key=lambda chunk: (
+        chunk["metadata"].get("course_file_id") or 0,
+        str(chunk["metadata"].get("file_id")),
+        chunk["metadata"].get("chunk_id") or 0
+    ))
+    for rank, chunk in enumerate(chunks):
+        chunk["rank"] = rank + 1
+    passages, tokens = pack_context(chunks, max_tokens)
+    return {
+        "course_id": str(course_id),
+        "text": "\n\n".join(passage["content"] for passage in passages),
+        "tokens": tokens,
+        "num_chunks": len(chunks)
+    }
+
+def normalize_query(query):
+    """Cache key form of a query (the embedding model is uncased)"""
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+class RetrievalCache:
+    """
+    LRU cache of search results keyed by (course_id, normalized query, n_results, keep_adjacent)
+
+    Each entry remembers the course version it was computed against (see
+    course_versions), so any write to a course's chunks invalidates its
+    cached results without having to track individual keys. With a shared
+    path, results are also stored in SQLite so other workers can reuse them.
+    """
+    def __init__(self, max_entries=None, shared_path=None):
+        self.max_entries = max_entries or RETRIEVAL_CACHE_SIZE
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.stale = 0
+
+        self._shared = None
+        shared_path = shared_path or RETRIEVAL_CACHE_SHARED_PATH
+        if shared_path:
+            self._shared = sqlite3.connect(shared_path, check_same_thread=False, timeout=30)
+            self._shared.execute("PRAGMA journal_mode=WAL")
+            self._shared.execute(
+                "CREATE TABLE IF NOT EXISTS retrieval_results ("
+                " key TEXT PRIMARY KEY, version INTEGER NOT NULL, result TEXT NOT NULL)"
+            )
+            self._shared.commit()
+
+    @staticmethod
+    def _key(query, n_results, course_id, keep_adjacent):
+        return (str(course_id) if course_id else None, normalize_query(query), n_results, keep_adjacent)
+
+    def get(self, query, n_results, course_id, version, keep_adjacent=False):
+        """Cached result for the current course version, or None"""
+        key = self._key(query, n_results, course_id, keep_adjacent)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.stale += 1
+
+            if self._shared is not None:
+                row = self._shared.execute(
+                    "SELECT result FROM retrieval_results WHERE key = ? AND version = ?",
+                    (json.dumps(key), version)
+                ).fetchone()
+                if row:
+                    result = json.loads(row[0])
+                    self._put(key, version, result)
+                    self.shared_hits += 1
+                    return result
+
+            self.misses += 1
+            return None
+
+    def put(self, query, n_results, course_id, version, result, keep_adjacent=False):
+        key = self._key(query, n_results, course_id, keep_adjacent)
+        with self._lock:
+            self._put(key, version, result)
+            if self._shared is not None:
+                self._shared.execute(
+                    "INSERT OR REPLACE INTO retrieval_results (key, version, result) VALUES (?, ?, ?)",
+                    (json.dumps(key), version, json.dumps(result))
+                )
+                self._shared.commit()
+
+    def _put(self, key, version, result):
+        self._entries[key] = (version, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """Hit/miss counters for this process"""
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": round((self.hits + self.shared_hits) / lookups, 4) if lookups else None,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "shared": self._shared is not None
+        }
+
+retrieval_cache = RetrievalCache()
+
+def cached_search(collections, query, n_results=3, course_id=None, keep_adjacent=False):
+    """search_course_materials with results cached until the course changes"""
+    course_id = course_id or None  # "" searches every course; version it as such
+    # Read the version first: a write that lands mid-search makes the entry stale
+    version = get_version(course_id)
+    result = retrieval_cache.get(query, n_results, course_id, version, keep_adjacent)
+    if result is None:
+        result = search_course_materials(collections, query, n_results, course_id, keep_adjacent)
+        # Not cached when the keyword index lagged behind: it would outlive the rebuild
+        if not result["keyword_index_stale"]:
+            retrieval_cache.put(query, n_results, course_id, version, result, keep_adjacent)
+    else:
+        print(f"💾 Retrieval cache hit for course {course_id if course_id else 'ALL'}")  # DEBUG
+    # Echo back this caller's query, not the one that filled the cache
+    return {**result, "query": query}
+
+def cached_search_batch(collections, queries, n_results=3):
+    """
+    cached_search for many (query, course_id) pairs in one pass
+
+    Cached results are reused; the remaining queries are embedded together
+    in a single call and searched with one Chroma query per course.
+
+    Returns:
+        Result dicts in the same order as queries
+    """
+    queries = [(query, course_id or None) for query, course_id in queries]
+    versions = {course_id: get_version(course_id) for _, course_id in queries}
+    results = [retrieval_cache.get(query, n_results, course_id, versions[course_id]) for query, course_id in queries]
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        embeddings = get_embedding_function()([queries[i][0] for i in pending])
+        groups = {}
+        for i, embedding in zip(pending, embeddings):
+            groups.setdefault(queries[i][1], []).append((i, embedding))
+        for course_id, members in groups.items():
+            found = search_course_materials_batch(
+                collections, [queries[i][0] for i, _ in members], n_results, course_id,
+                query_embeddings=[embedding for _, embedding in members]
+            )
+            for (i, _), result in zip(members, found):
+                if not result["keyword_index_stale"]:
+                    retrieval_cache.put(queries[i][0], n_results, course_id, versions[course_id], result)
+                results[i] = result
+
+    print(f"💾 Batch of {len(queries)} queries: {len(queries) - len(pending)} cached, {len(pending)} searched")  # DEBUG
+    return [{**result, "query": query} for result, (query, _) in zip(results, queries)]
+
+class RetrievalClient:
+    """Async interface the chat service uses to fetch course materials"""
+
+    async def retrieve(self, query, course_id=None, n_results=3, keep_adjacent=False):
+        """Return search results (same shape as /api/query-chroma) or None on failure"""
+        raise NotImplementedError
+
+    async def course_material(self, course_id, max_tokens):
+        """Return the start of a course's text (same shape as /api/course-material) or None on failure"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class InProcessRetrievalClient(RetrievalClient):
+    """Searches the course collections in this process; no HTTP or JSON round-trip"""
+
+    def __init__(self, collections=None):
+        self._collections = collections
+
+    @property
+    def collections(self):
+        if self._collections is None:
+            # Standalone chat service: open the backend's persistent store directly
+            from chroma_setup import init_chroma
+            from course_collections import CourseCollections
+            self._collections = CourseCollections(init_chroma())
+        return self._collections
+
+    async def retrieve(self, query, course_id=None, n_results=3, keep_adjacent=False):
+        try:
+            # Chroma is synchronous; keep it off the event loop
+            return await asyncio.to_thread(
+                cached_search, self.collections, query, n_results, course_id, keep_adjacent
+            )
+        except Exception as e:
+            print(f"❌ Error querying Chroma: {type(e).__name__}: {e}")
+            return None
+
+    async def course_material(self, course_id, max_tokens):
+        try:
+            return await asyncio.to_thread(course_material, self.collections, course_id, max_tokens)
+        except Exception as e:
+            print(f"❌ Error reading course material: {type(e).__name__}: {e}")
+            return None
+
+class HttpRetrievalClient(RetrievalClient):
+    """Calls the backend's /api/query-chroma with a pooled async HTTP client"""
+
+    def __init__(self, base_url=None, timeout=None):
+        self.base_url = base_url or BACKEND_URL
+        self.timeout = timeout or RETRIEVAL_TIMEOUT
+        self._client = None
+
+    def _get_client(self):
+        # Created lazily so it binds to the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+            )
+        return self._client
+
+    async def retrieve(self, query, course_id=None, n_results=3, keep_adjacent=False):
+        params = {"query": query, "n_results": n_results}
+        if course_id:
+            params["course_id"] = course_id
+        if keep_adjacent:
+            params["keep_adjacent"] = "true"
+
+        try:
+            response = await self._get_client().get("/api/query-chroma", params=params)
+            response.raise_for_status()
+            data = response.json()
+            print(f"📦 Data received: {data.get('num_results', 0)} results")  # DEBUG
+            return data
+        except httpx.ConnectError:
+            print(f"❌ CONNECTION ERROR: Cannot reach backend at {self.base_url}")
+            print(f"   Make sure backend is running: uvicorn main:app --reload")
+            return None
+        except httpx.TimeoutException:
+            print(f"⏱️ TIMEOUT: Backend didn't respond in time")
+            return None
+        except Exception as e:
+            print(f"❌ Error querying Chroma: {type(e).__name__}: {e}")
+            return None
+
+    async def course_material(self, course_id, max_tokens):
+        try:
+            response = await self._get_client().get(
+                "/api/course-material", params={"course_id": course_id, "max_tokens": max_tokens}
+            )
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            print(f"❌ Error reading course material: {type(e).__name__}: {e}")
+            return None
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+def create_retrieval_client(mode=None):
+    """Build the retrieval client selected by RETRIEVAL_MODE"""
+    mode = mode or RETRIEVAL_MODE
+    if mode == "inprocess":
+        return InProcessRetrievalClient()
+    if mode == "http":
+        return HttpRetrievalClient()
+    raise ValueError(f"Unknown RETRIEVAL_MODE '{mode}' (expected 'inprocess' or 'http')")
@@ -0,0 +1,216 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+
+from google.genai import types
+
+from text_chunker import estimate_tokens
+
+# Chat sessions live in their own SQLite file next to the other chat-side stores
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "chat_sessions.db")
+
+# Token budget for verbatim recent turns sent with each question
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "1500"))
+# Older turns are folded into the rolling summary once this many tokens have
+# fallen out of the window (summarizing in batches keeps model calls rare)
+SESSION_SUMMARIZE_MIN_TOKENS = int(os.getenv("SESSION_SUMMARIZE_MIN_TOKENS", "400"))
+# Sessions untouched for this long are deleted
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+
+@dataclass
+class SessionWindow:
+    """What a session contributes to the next prompt"""
+    summary: str = ""
+    # (question, answer) pairs inside the token budget, oldest first
+    turns: list = field(default_factory=list)
+    # Older turns not yet in the summary: [(turn_id, question, answer)]
+    overflow: list = field(default_factory=list)
+    overflow_tokens: int = 0
+
+    @property
+    def empty(self):
+        # Unsummarized overflow is history too, even though it isn't in the prompt
+        return not self.summary and not self.turns and not self.overflow
+
+class SessionStore:
+    """
+    Server-side chat history per session
+
+    Each turn (question + answer) is stored with its token estimate. The
+    prompt gets the rolling summary plus as many of the newest turns as fit
+    in the token budget, so prompt size stays bounded however long the
+    session runs. Turns that fall out of the window are summarized later
+    (see summarize_overflow) and then only survive through the summary.
+    """
+    def __init__(self, path=None, history_tokens=None):
+        self.path = path or SESSION_DB_PATH
+        self.history_tokens = history_tokens or SESSION_HISTORY_TOKENS
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, course_id TEXT, summary TEXT NOT NULL DEFAULT '',"
+            " summarized_upto INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL,"
+            " question TEXT NOT NULL, answer TEXT NOT NULL, tokens INTEGER NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_turns_session ON turns(session_id, id)")
+        self._conn.commit()
+
+    def load_window(self, session_id):
+        """Summary, in-budget recent turns and unsummarized overflow for a session"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, summarized_upto FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return SessionWindow()
+            summary, summarized_upto = row
+            rows = self._conn.execute(
+                "SELECT id, question, answer, tokens FROM turns"
+                " WHERE session_id = ? AND id > ? ORDER BY id DESC",
+                (session_id, summarized_upto)
+            ).fetchall()
+
+        window = SessionWindow(summary=summary)
+        used = 0
+        for i, (turn_id, question, answer, tokens) in enumerate(rows):
+            if used + tokens > self.history_tokens:
+                # Everything older than this turn is outside the window
+                for old_id, old_question, old_answer, old_tokens in reversed(rows[i:]):
+                    window.overflow.append((old_id, old_question, old_answer))
+                    window.overflow_tokens += old_tokens
+                break
+            window.turns.append((question, answer))
+            used += tokens
+        window.turns.reverse()
+        return window
+
+    def append_turn(self, session_id, question, answer, course_id=None):
+        """Record one question/answer exchange"""
+        now = time.time()
+        tokens = estimate_tokens(question) + estimate_tokens(answer)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (id, course_id, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at",
+                (session_id, str(course_id) if course_id else None, now)
+            )
+            self._conn.execute(
+                "INSERT INTO turns (session_id, question, answer, tokens, created_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, question, answer, tokens, now)
+            )
+            self._conn.commit()
+
+    def save_summary(self, session_id, summary, summarized_upto):
+        """Replace the rolling summary and drop the turns it now covers"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE sessions SET summary = ?, summarized_upto = ? WHERE id = ? AND summarized_upto < ?",
+                (summary, summarized_upto, session_id, summarized_upto)
+            )
+            self._conn.execute(
+                "DELETE FROM turns WHERE session_id = ? AND id <= ?", (session_id, summarized_upto)
+            )
+            self._conn.commit()
+
+    def delete_session(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            deleted = self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount
+            self._conn.commit()
+        return deleted > 0
+
+    def purge_expired(self, ttl=None):
+        """Delete sessions idle for longer than the TTL; returns how many"""
+        cutoff = time.time() - (ttl or SESSION_TTL)
+        with self._lock:
+            expired = [row[0] for row in self._conn.execute(
+                "SELECT id FROM sessions WHERE updated_at < ?", (cutoff,)
+            ).fetchall()]
+            for session_id in expired:
+                self._conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._conn.commit()
+        return len(expired)
+
+def summary_prompt(previous_summary, turns):
+    """Prompt asking Gemini for an updated rolling summary of a tutoring session"""
+    transcript = "\n\n".join(f"Student: {question}\nTutor: {answer}" for question, answer in turns)
+    return f"""Summary of the tutoring session so far:
+{previous_summary or "(none)"}
+
+Further conversation:
+{transcript}
+
+Write an updated summary of the whole session in at most 150 words. Keep the topics covered, what the
+student has already understood or attempted, and any open questions. Write it as plain notes for the tutor."""
+
+def history_contents(window):
+    """Gemini contents for a window's summary and recent turns (none for window=None)"""
+    contents = []
+    if window is None:
+        return contents
+    if window.summary:
+        contents.append(types.Content(role="user", parts=[types.Part(
+            text=f"(Summary of our earlier conversation: {window.summary})"
+        )]))
+        contents.append(types.Content(role="model", parts=[types.Part(text="Understood.")]))
+    for question, answer in window.turns:
+        contents.append(types.Content(role="user", parts=[types.Part(text=question)]))
+        contents.append(types.Content(role="model", parts=[types.Part(text=answer)]))
+    return contents
+
+async def summarize_overflow(store, session_id, window, summarize, min_tokens=None):
+    """
+    Fold turns that fell out of the window into the session summary
+
+    Args:
+        store: SessionStore
+        session_id: Session to update
+        window: SessionWindow loaded before the current turn
+        summarize: async callable(previous_summary, [(question, answer)]) -> new summary
+        min_tokens: Least overflow worth a summary (default SESSION_SUMMARIZE_MIN_TOKENS)
+
+    Returns:
+        True if the summary was updated
+    """
+    min_tokens = SESSION_SUMMARIZE_MIN_TOKENS if min_tokens is None else min_tokens
+    if not window.overflow or window.overflow_tokens < min_tokens:
+        return False
+    turns = [(question, answer) for _, question, answer in window.overflow]
+    summary = await summarize(window.summary, turns)
+    if not summary:
+        return False
+    await asyncio.to_thread(store.save_summary, session_id, summary.strip(), window.overflow[-1][0])
+    print(f"🧠 Summarized {len(turns)} older turns of session {session_id}")  # DEBUG
+    return True
+
+async def load_window_summarized(store, session_id, summarize):
+    """
+    load_window, summarizing right away when no recent turn fits the budget
+
+    If the newest turn alone is over the history budget, every turn is
+    overflow and the prompt would carry none of the conversation until the
+    background summary caught up. The overflow is summarized first in that
+    case; if that fails, the window is returned as loaded (its overflow
+    still marks it as not empty).
+    """
+    window = await asyncio.to_thread(store.load_window, session_id)
+    if window.turns or not window.overflow:
+        return window
+    try:
+        if await summarize_overflow(store, session_id, window, summarize, min_tokens=0):
+            window = await asyncio.to_thread(store.load_window, session_id)
+    except Exception as e:
+        print(f"⚠️ Session summary failed: {type(e).__name__}: {e}")
+    return window
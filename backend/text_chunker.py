@@ -1,3 +1,15 @@
+import re
+import numpy as np
+
+# Rough token model: words and individual punctuation marks. Close enough to
+# wordpiece counts for budgeting, and cheap to compute with one regex pass.
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+# Candidate cut points: end of a paragraph (blank line / page break) or of a sentence
+_BOUNDARY_RE = re.compile(r"\n\s*\n\s*|(?<=[.!?])[\"')\]]*\s+")
+
+PAGE_SEPARATOR = "\n\n"
+
 def chunk_text(text, chunk_size=500, overlap=50):
     """
     Split text into overlapping chunks
@@ -22,6 +34,131 @@ def chunk_text(text, chunk_size=500, overlap=50):
     return chunks
 
 
+def estimate_tokens(text):
+    """Approximate token count of a string"""
+    return len(_TOKEN_RE.findall(text))
+
+
+def _chunk_spans(text, max_tokens, overlap_tokens):
+    """
+    Compute (start, end) character spans of chunks in a single pass
+
+    Token positions and boundary positions are each found with one regex
+    scan; chunk ends are then picked with binary searches over the
+    cumulative token counts at each boundary.
+    """
+    token_starts = np.fromiter((m.start() for m in _TOKEN_RE.finditer(text)), dtype=np.int64)
+    num_tokens = len(token_starts)
+    if num_tokens == 0:
+        return []
+
+    boundary_pos = []
+    is_paragraph = []
+    for m in _BOUNDARY_RE.finditer(text):
+        boundary_pos.append(m.end())
+        is_paragraph.append(m.group(0).count("\n") >= 2)
+    boundary_pos.append(len(text))
+    is_paragraph.append(True)
+    boundary_pos = np.array(boundary_pos, dtype=np.int64)
+    is_paragraph = np.array(is_paragraph, dtype=bool)
+
+    # Tokens before each boundary (vectorized over all boundaries at once)
+    boundary_tokens = np.searchsorted(token_starts, boundary_pos)
+    min_tokens = max(1, max_tokens // 2)
+
+    spans = []
+    start_tok = 0
+    while start_tok < num_tokens:
+        start_pos = int(token_starts[start_tok])
+        limit = start_tok + max_tokens
+
+        if limit >= num_tokens:
+            spans.append((start_pos, len(text)))
+            break
+
+        # Boundaries that keep the chunk between min_tokens and max_tokens
+        lo = np.searchsorted(boundary_tokens, start_tok + min_tokens, side="left")
+        hi = np.searchsorted(boundary_tokens, limit, side="right")
+
+        if hi > lo:
+            window = slice(lo, hi)
+            paragraphs = np.flatnonzero(is_paragraph[window])
+            # Prefer a paragraph/page break in the back half of the window
+            if len(paragraphs) and paragraphs[-1] >= (hi - lo) // 2:
+                j = lo + paragraphs[-1]
+            else:
+                j = hi - 1
+            end_tok = int(boundary_tokens[j])
+            end_pos = int(boundary_pos[j])
+        else:
+            # No sentence ends in range (very long sentence): hard cut on a token
+            end_tok = limit
+            end_pos = int(token_starts[end_tok])
+
+        spans.append((start_pos, end_pos))
+
+        # Next chunk starts on the first sentence boundary inside the overlap
+        next_tok = end_tok
+        if overlap_tokens > 0:
+            k = np.searchsorted(boundary_tokens, end_tok - overlap_tokens, side="left")
+            if k < len(boundary_tokens) and start_tok < boundary_tokens[k] < end_tok:
+                next_tok = int(boundary_tokens[k])
+        start_tok = next_tok
+
+    return spans
+
+
+def iter_chunks(pages, max_tokens=160, overlap_tokens=24):
+    """
+    Stream sentence-aware chunks from an iterable of page texts
+
+    Chunks end on paragraph, page or sentence boundaries and hold at most
+    max_tokens tokens (a sentence longer than that is cut on a token).
+    Consecutive chunks share up to overlap_tokens tokens of whole sentences.
+    Pages are consumed lazily, so chunks are yielded before the last page
+    is read.
+
+    Args:
+        pages: Iterable of page text strings (a single string also works as [text])
+        max_tokens: Token budget per chunk
+        overlap_tokens: Tokens of trailing context repeated in the next chunk
+
+    Yields:
+        Chunk text strings
+    """
+    if isinstance(pages, str):
+        pages = [pages]
+
+    buffer = ""
+    for page in pages:
+        buffer += page + PAGE_SEPARATOR
+        # Chunk once enough text is buffered, keeping the last (possibly
+        # incomplete) chunk to be continued by the next page
+        if estimate_tokens(buffer) < 4 * max_tokens:
+            continue
+        spans = _chunk_spans(buffer, max_tokens, overlap_tokens)
+        for start, end in spans[:-1]:
+            chunk = buffer[start:end].strip()
+            if chunk:
+                yield chunk
+        buffer = buffer[spans[-1][0]:]
+
+    for start, end in _chunk_spans(buffer, max_tokens, overlap_tokens):
+        chunk = buffer[start:end].strip()
+        if chunk:
+            yield chunk
+
+
+def chunk_text_by_tokens(text, max_tokens=160, overlap_tokens=24):
+    """
+    Split text into sentence-aware chunks with a token budget
+
+    Returns:
+        List of text chunks
+    """
+    return list(iter_chunks([text], max_tokens=max_tokens, overlap_tokens=overlap_tokens))
+
+
 if __name__ == "__main__":
     # Test it
     sample_text = """
@@ -32,4 +169,9 @@ if __name__ == "__main__":
     chunks = chunk_text(sample_text, chunk_size=500, overlap=50)
     print(f"Created {len(chunks)} chunks")
     print(f"First chunk: {chunks[0][:100]}...")
+    print(f"Last chunk: {chunks[-1][:100]}...")
+
+    chunks = chunk_text_by_tokens(sample_text, max_tokens=160, overlap_tokens=24)
+    print(f"Created {len(chunks)} sentence-aware chunks")
+    print(f"First chunk: {chunks[0][:100]}...")
     print(f"Last chunk: {chunks[-1][:100]}...")
\ No newline at end of file
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from pathlib import Path
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal, CourseFile, StoredFile
+
+# Uploads are stored by content: uploads/<sha256>.pdf
+UPLOAD_DIR = Path("uploads")
+UPLOAD_DIR.mkdir(exist_ok=True)
+
+# Largest accepted upload, and how much of it is held in memory at a time
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+class UploadRejected(Exception):
+    """Upload refused before being stored (too large, not a PDF, ...)"""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def file_path_for(file_id):
+    """Path of an uploaded file (content hash, or legacy uuid4 id)"""
+    return UPLOAD_DIR / f"{file_id}.pdf"
+
+async def save_upload(db, upload, max_bytes=None):
+    """
+    Stream an upload to disk under its content hash
+
+    The file is read, hashed and written in UPLOAD_CHUNK_BYTES pieces, so
+    memory use per upload stays bounded regardless of file size. Identical
+    bytes always map to the same file_id, so a re-upload doesn't create a
+    second copy on disk.
+
+    Args:
+        db: Database session (caller commits)
+        upload: FastAPI UploadFile
+        max_bytes: Size limit (default MAX_UPLOAD_BYTES)
+
+    Returns:
+        (StoredFile row, True if the bytes were new)
+
+    Raises:
+        UploadRejected: file is too large or isn't a PDF
+    """
+    max_bytes = MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+
+    # Reject early when the size is already known from the request
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadRejected(f"File exceeds {max_bytes // (1024 * 1024)} MB limit", status_code=413)
+
+    sha = hashlib.sha256()
+    size = 0
+    # Write to a temp name first so a half-written file never has the final name
+    tmp_path = UPLOAD_DIR / f".{uuid.uuid4()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                if size == 0 and b"%PDF" not in chunk[:1024]:
+                    raise UploadRejected("File is not a valid PDF")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(f"File exceeds {max_bytes // (1024 * 1024)} MB limit", status_code=413)
+                sha.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+
+        if size == 0:
+            raise UploadRejected("File is empty")
+
+        file_id = sha.hexdigest()
+        file_path = file_path_for(file_id)
+        is_new = not file_path.exists()
+        if is_new:
+            os.replace(tmp_path, file_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    stored = db.query(StoredFile).filter(StoredFile.id == file_id).first()
+    if stored is None:
+        try:
+            # Savepoint: a concurrent upload of the same bytes may insert the row first
+            with db.begin_nested():
+                stored = StoredFile(id=file_id, filename=upload.filename, size=size, ref_count=0)
+                db.add(stored)
+        except IntegrityError:
+            # The other upload's row wins; the caller's add_reference counts this one
+            stored = db.query(StoredFile).filter(StoredFile.id == file_id).one()
+
+    return stored, is_new
+
+def add_reference(db, file_id):
+    """Record that one more course uses this file (caller commits)"""
+    # Increment in SQL so concurrent requests don't overwrite each other's count
+    db.query(StoredFile).filter(StoredFile.id == file_id).update(
+        {StoredFile.ref_count: func.coalesce(StoredFile.ref_count, 0) + 1},
+        synchronize_session=False
+    )
+    stored = db.query(StoredFile).filter(StoredFile.id == file_id).first()
+    if stored is not None:
+        db.refresh(stored, ["ref_count"])
+    return stored
+
+def release_reference(db, file_id):
+    """
+    Drop one course reference; delete the file once nothing uses it (caller commits)
+
+    Returns:
+        True if the file was deleted
+    """
+    stored = db.query(StoredFile).filter(StoredFile.id == file_id).first()
+    if stored is None:
+        return False
+
+    stored.ref_count = max((stored.ref_count or 0) - 1, 0)
+    if stored.ref_count == 0:
+        file_path_for(file_id).unlink(missing_ok=True)
+        db.delete(stored)
+        return True
+    return False
+
+def get_indexed_chunks(collections, file_id, exclude_course_id=None, chunker=None):
+    """
+    Find chunks already embedded for this file by another course
+
+    Args:
+        collections: CourseCollections
+        file_id: Content hash of the file
+        exclude_course_id: Course to ignore (the one being ingested)
+        chunker: Only reuse chunks made with this chunker id
+
+    Returns:
+        Dict with "documents", "embeddings", "metadatas" ordered by chunk_id,
+        or None if the file has never been embedded
+    """
+    # Courses that have this file, from the database rather than by scanning every collection
+    db = SessionLocal()
+    try:
+        # Only finished copies: a queued or failed ingest may have stored just part of the file
+        course_ids = [
+            course_id for (course_id,) in db.query(CourseFile.course_id).filter(
+                CourseFile.file_id == file_id,
+                CourseFile.course_id != exclude_course_id,
+                CourseFile.status == "indexed"
+            ).distinct()
+        ]
+    finally:
+        db.close()
+
+    where = {"file_id": file_id}
+    if chunker:
+        where = {"$and": [{"file_id": file_id}, {"chunker": chunker}]}
+
+    # Take the most complete copy
+    best = None
+    for course_id in course_ids:
+        collection = collections.for_course(course_id, create=False)
+        if collection is None:
+            continue
+        results = collection.get(
+            where=where,
+            include=["documents", "embeddings", "metadatas"]
+        )
+        if results["ids"] and (best is None or len(results["ids"]) > len(best["ids"])):
+            best = results
+    if best is None:
+        return None
+
+    indexes = sorted(range(len(best["ids"])), key=lambda i: best["metadatas"][i].get("chunk_id", 0))
+    return {
+        "documents": [best["documents"][i] for i in indexes],
+        "embeddings": [best["embeddings"][i] for i in indexes],
+        "metadatas": [best["metadatas"][i] for i in indexes]
+    }
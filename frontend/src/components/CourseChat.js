@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import ReactMarkdown from 'react-markdown';
+import { streamChat } from './chatStream';
 import './StudentChat.css';
 
 function CourseChat() {
@@ -11,6 +12,9 @@ function CourseChat() {
   const [messages, setMessages] = useState([]);
   const [inputText, setInputText] = useState('');
   const [isTyping, setIsTyping] = useState(false);
+  const [streamingId, setStreamingId] = useState(null);
+  // Lets the chat API keep this conversation's history server-side
+  const [sessionId] = useState(() => crypto.randomUUID());
   const [dotPosition, setDotPosition] = useState(0);
   const [error, setError] = useState('');
   const [loading, setLoading] = useState(true);
@@ -63,35 +67,40 @@ function CourseChat() {
       setIsTyping(true);
       setError('');
       
+      const aiId = messages.length + 2;
+      let sources = [];
+      let started = false;
+
       try {
-        // Call the chat API with course-specific context
-        const response = await fetch('http://localhost:8001/api/chat', {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({
+        // Stream the answer: sources arrive first, then the text token by token
+        const answer = await streamChat(
+          {
             question: currentQuestion,
             subject: courseSubject,
-            course_id: courseId
-          })
-        });
+            course_id: courseId,
+            session_id: sessionId
+          },
+          {
+            onSources: (received) => {
+              sources = received;
+            },
+            onToken: (text) => {
+              if (!started) {
+                // First token replaces the typing dots with the AI message
+                started = true;
+                setStreamingId(aiId);
+                setMessages(prev => [...prev, { id: aiId, text, sender: 'ai', sources }]);
+              } else {
+                setMessages(prev => prev.map(m => (m.id === aiId ? { ...m, text: m.text + text } : m)));
+              }
+            }
+          }
+        );
 
-        if (!response.ok) {
-          throw new Error(`API error: ${response.status}`);
+        if (!started) {
+          // Nothing was streamed; still show the (empty) answer and its sources
+          setMessages(prev => [...prev, { id: aiId, text: answer, sender: 'ai', sources }]);
         }
-
-        const data = await response.json();
-        
-        // Add AI response to messages
-        const aiResponse = {
-          id: messages.length + 2,
-          text: data.answer,
-          sender: 'ai',
-          sources: data.sources || []
-        };
-        
-        setMessages(prev => [...prev, aiResponse]);
         
       } catch (error) {
         console.error('Chat error:', error);
@@ -99,13 +108,14 @@ function CourseChat() {
         
         // Add error message to chat
         const errorMessage = {
-          id: messages.length + 2,
+          id: started ? aiId + 1 : aiId,
           text: "Sorry, I encountered an error. Please try again.",
           sender: 'ai'
         };
         setMessages(prev => [...prev, errorMessage]);
       } finally {
         setIsTyping(false);
+        setStreamingId(null);
       }
     }
   };
@@ -248,7 +258,7 @@ function CourseChat() {
             </div>
           </div>
         ))}
-        {isTyping && (
+        {isTyping && streamingId === null && (
           <div className="message-row ai">
             <div className="message-bubble ai">
               {renderDots()}
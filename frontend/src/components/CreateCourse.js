@@ -1,7 +1,10 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import './CreateCourse.css';
 
+// Ingestion job statuses that stop polling
+const finishedStatuses = ['completed', 'failed', 'cancelled'];
+
 function CreateCourse() {
   const [courseName, setCourseName] = useState('');
   const [subject, setSubject] = useState('generic');
@@ -10,6 +13,8 @@ function CreateCourse() {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
   const [courseCode, setCourseCode] = useState('');
+  // Ingestion job for the uploaded PDF (indexing runs after the course is created)
+  const [job, setJob] = useState(null);
   const navigate = useNavigate();
 
   const subjects = [
@@ -20,6 +25,61 @@ function CreateCourse() {
     { value: 'computer_science', label: 'Computer Science' }
   ];
 
+  const jobFinished = job && finishedStatuses.includes(job.status);
+
+  // Poll the ingestion job until the materials are indexed (or indexing fails)
+  useEffect(() => {
+    if (!job || finishedStatuses.includes(job.status)) {
+      return;
+    }
+    const timeout = setTimeout(async () => {
+      try {
+        const token = localStorage.getItem('token');
+        const response = await fetch(`http://localhost:8000/api/jobs/${job.id}`, {
+          headers: {
+            'Authorization': `Bearer ${token}`
+          }
+        });
+        if (!response.ok) {
+          const data = await response.json();
+          throw new Error(data.detail || 'Failed to check indexing status');
+        }
+        setJob(await response.json());
+      } catch (err) {
+        setJob(prev => ({ ...prev, status: 'failed', error: err.message }));
+      }
+    }, 2000);
+    return () => clearTimeout(timeout);
+  }, [job]);
+
+  // Go to the dashboard a few seconds after indexing completes
+  useEffect(() => {
+    if (job && job.status === 'completed') {
+      const timeout = setTimeout(() => {
+        navigate('/dashboard');
+      }, 3000);
+      return () => clearTimeout(timeout);
+    }
+  }, [job, navigate]);
+
+  const jobStatusMessage = () => {
+    switch (job.status) {
+      case 'queued':
+        return 'Waiting to index course materials...';
+      case 'running':
+        return job.percent != null
+          ? `Indexing course materials... ${Math.round(job.percent)}%`
+          : 'Indexing course materials...';
+      case 'completed':
+        return 'Course materials indexed. Redirecting to courses...';
+      case 'cancelling':
+      case 'cancelled':
+        return 'Indexing was cancelled.';
+      default:
+        return `Indexing failed${job.error ? `: ${job.error}` : ''}`;
+    }
+  };
+
   const guardrails = [
     { value: 'strict', label: 'Strict', description: 'Minimal help, focus on guidance' },
     { value: 'moderate', label: 'Moderate', description: 'Balanced help and learning' },
@@ -79,11 +139,7 @@ function CreateCourse() {
 
       const data = await response.json();
       setCourseCode(data.course.course_code);
-      
-      // Show success for 3 seconds then redirect
-      setTimeout(() => {
-        navigate('/dashboard');
-      }, 3000);
+      setJob(data.job);
 
     } catch (err) {
       setError(err.message);
@@ -99,7 +155,22 @@ function CreateCourse() {
           <h2>Course Created Successfully!</h2>
           <p>Share this code with your students:</p>
           <div className="course-code-display">{courseCode}</div>
-          <p className="redirect-message">Redirecting to courses...</p>
+          {job && (
+            <div className={`job-status ${job.status === 'completed' ? 'done' : jobFinished ? 'failed' : ''}`}>
+              {!jobFinished && <div className="job-spinner" />}
+              <span>{jobStatusMessage()}</span>
+              {job.status === 'running' && job.percent != null && (
+                <div className="job-progress">
+                  <div className="job-progress-bar" style={{ width: `${job.percent}%` }} />
+                </div>
+              )}
+            </div>
+          )}
+          {job && job.status !== 'completed' && (
+            <button className="create-button" onClick={() => navigate('/dashboard')}>
+              Go to courses
+            </button>
+          )}
         </div>
       </div>
     );
@@ -1,11 +1,15 @@
 import React, { useState, useEffect } from 'react';
 import ReactMarkdown from 'react-markdown';
+import { streamChat } from './chatStream';
 import './StudentChat.css';
 
 function StudentChat() {
   const [messages, setMessages] = useState([]);
   const [inputText, setInputText] = useState('');
   const [isTyping, setIsTyping] = useState(false);
+  const [streamingId, setStreamingId] = useState(null);
+  // Lets the chat API keep this conversation's history server-side
+  const [sessionId] = useState(() => crypto.randomUUID());
   const [dotPosition, setDotPosition] = useState(0);
   const [error, setError] = useState('');
 
@@ -30,34 +34,39 @@ function StudentChat() {
       setIsTyping(true);
       setError('');
       
+      const aiId = messages.length + 2;
+      let sources = [];
+      let started = false;
+
       try {
-        // Call the real chat API
-        const response = await fetch('http://localhost:8001/api/chat', {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({
+        // Stream the answer: sources arrive first, then the text token by token
+        const answer = await streamChat(
+          {
             question: currentQuestion,
             subject: 'generic', // TODO: Get from course settings
-          })
-        });
+            session_id: sessionId
+          },
+          {
+            onSources: (received) => {
+              sources = received;
+            },
+            onToken: (text) => {
+              if (!started) {
+                // First token replaces the typing dots with the AI message
+                started = true;
+                setStreamingId(aiId);
+                setMessages(prev => [...prev, { id: aiId, text, sender: 'ai', sources }]);
+              } else {
+                setMessages(prev => prev.map(m => (m.id === aiId ? { ...m, text: m.text + text } : m)));
+              }
+            }
+          }
+        );
 
-        if (!response.ok) {
-          throw new Error(`API error: ${response.status}`);
+        if (!started) {
+          // Nothing was streamed; still show the (empty) answer and its sources
+          setMessages(prev => [...prev, { id: aiId, text: answer, sender: 'ai', sources }]);
         }
-
-        const data = await response.json();
-        
-        // Add AI response to messages
-        const aiResponse = {
-          id: messages.length + 2,
-          text: data.answer,
-          sender: 'ai',
-          sources: data.sources || []
-        };
-        
-        setMessages(prev => [...prev, aiResponse]);
         
       } catch (error) {
         console.error('Chat error:', error);
@@ -65,13 +74,14 @@ function StudentChat() {
         
         // Add error message to chat
         const errorMessage = {
-          id: messages.length + 2,
+          id: started ? aiId + 1 : aiId,
           text: "Sorry, I encountered an error. Please try again.",
           sender: 'ai'
         };
         setMessages(prev => [...prev, errorMessage]);
       } finally {
         setIsTyping(false);
+        setStreamingId(null);
       }
     }
   };
@@ -133,7 +143,7 @@ function StudentChat() {
             </div>
           </div>
         ))}
-        {isTyping && (
+        {isTyping && streamingId === null && (
           <div className="message-row ai">
             <div className="message-bubble ai">
               {renderDots()}
@@ -0,0 +1,60 @@
+// Client for the streaming chat endpoint (POST /api/chat/stream).
+// The server sends server-sent events: "sources", then "token" events as the
+// answer is generated, then "done" (or "error").
+const CHAT_STREAM_URL = 'http://localhost:8001/api/chat/stream';
+
+export async function streamChat(body, { onSources, onToken }) {
+  // Chat sessions (session_id) belong to the signed-in user
+  const token = localStorage.getItem('token');
+  const response = await fetch(CHAT_STREAM_URL, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      ...(token ? { 'Authorization': `Bearer ${token}` } : {}),
+    },
+    body: JSON.stringify(body)
+  });
+
+  if (!response.ok) {
+    throw new Error(`API error: ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let answer = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      let data = '';
+      raw.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      });
+      const payload = data ? JSON.parse(data) : {};
+
+      if (event === 'sources') {
+        onSources(payload.sources || []);
+      } else if (event === 'token') {
+        answer += payload.text;
+        onToken(payload.text);
+      } else if (event === 'done') {
+        return payload.answer ?? answer;
+      } else if (event === 'error') {
+        throw new Error(`API error: ${payload.status} ${payload.detail}`);
+      }
+    }
+  }
+
+  return answer;
+}